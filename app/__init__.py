@@ -53,7 +53,9 @@ def app_init():
     db.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
-    migrate.init_app(app, db)
+    # the paper partitions are not a part of the model
+    from .partitions import include_name
+    migrate.init_app(app, db, include_name=include_name)
 
     level = logging.DEBUG if app.config['DEBUG'] else logging.INFO
     log_file = app.config.get('LOG_PATH') if app.config.get('LOG_PATH') else ''
@@ -77,6 +79,13 @@ def app_init():
         from . import settings
         from . import autohooks
         from . import error_handler
+        from . import partitions
+        from . import jobs
+        from . import paper_db
+        from .papers import rule_cache, listing_cache, feed_cache
+        rule_cache.resize(app.config['TAG_RULE_CACHE_SIZE'])
+        listing_cache.resize(app.config['LISTING_CACHE_SIZE'], app.config['LISTING_CACHE_BYTES'])
+        feed_cache.resize(app.config['RSS_CACHE_SIZE'], app.config['RSS_CACHE_BYTES'])
         app.register_blueprint(routes.main_bp)
         app.register_blueprint(auth.auth_bp)
         app.register_blueprint(settings.settings_bp)
@@ -84,4 +93,8 @@ def app_init():
 
         csrf.exempt(autohooks.auto_bp)
 
+        app.cli.add_command(partitions.partitions_cli)
+        app.cli.add_command(jobs.jobs_cli)
+        app.cli.add_command(paper_db.papers_cli)
+
         return app
@@ -9,23 +9,31 @@ Module with daemon functions that work are triggered by hooks.
 import logging
 from datetime import datetime, timedelta
 from functools import wraps
+from itertools import groupby
 from json import dumps
-from typing import List
+from time import perf_counter
+from typing import List, Dict, Tuple, Optional
 
 from feedgen.feed import FeedGenerator
-from flask import Blueprint, current_app, request, render_template, make_response, redirect, url_for, flash
+from flask import Blueprint, current_app, request, render_template, make_response, redirect, \
+    url_for, flash, g
 from flask_login import current_user
 from flask_mail import Message
+from sqlalchemy import func
 
 from .interfaces.data_structures import PaperInterface, PaperResponse, TagInterface
-from .interfaces.model import User, Tag, db, Paper, \
-    paper_associate, PaperCacheDay, PaperCacheWeeks
+from .interfaces.model import User, Tag, db, Paper, UpdateDate, \
+    paper_associate, PaperCacheDay, PaperCacheWeeks, Job, PAPER_PARTITIONS
+from .jobs import enqueue_job, job_info
 from .paper_api import ArxivOaiApi
-from .paper_db import update_papers
-from .papers import tag_suitable, process_papers
+from .paper_db import update_papers, refresh_paper_cache, add_list_papers
+from .partitions import ensure_partitions
+from .papers import compile_rule, process_papers, rule_cache, evaluate_rule_batch, PaperCorpus, \
+    rules_to_sql, rules_need_abstract, load_abstracts, listing_cache, feed_cache, CategoryIndex
 from .routes import get_papers
 from .utils import decode_token, DecodeException
-from .utils_app import mail_catch, get_or_create_list, get_old_update_date
+from .utils_app import mail_catch, get_or_create_list, get_old_update_date, listing_etag, \
+    not_modified, set_etag, start_shard_run, finish_shard, job_progress
 
 auto_bp = Blueprint(
     'auto_bp',
@@ -54,8 +62,36 @@ def check_token(funct):
     return my_wrapper
 
 
+def queued(funct):
+    """
+    Decorator that puts the hook to the job queue if JOB_QUEUE is on.
+
+    The hook answers with the job id and is run by the worker, see jobs.py.
+    """
+
+    @wraps(funct)
+    def my_wrapper(*args, **kwargs):
+        if current_app.config['JOB_QUEUE'] and g.get('job_id') is None:
+            job = enqueue_job(request.endpoint, request.args.to_dict(), request.host_url)
+            return dumps({'success': True, 'job': job.id}), 202
+        return funct(*args, **kwargs)
+
+    return my_wrapper
+
+
+@auto_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@check_token
+def job_status(job_id: int):
+    """Status of the background job with the progress and durations."""
+    job = db.session.get(Job, job_id)
+    if not job:
+        return dumps({'success': False}), 404
+    return dumps(job_info(job)), 200
+
+
 @auto_bp.route('/load_papers', methods=['POST'])
 @check_token
+@queued
 def load_papers():
     """Load papers and store in the database."""
     # auth stuff
@@ -64,24 +100,69 @@ def load_papers():
     # last paper in the DB
     old_date_record = get_old_update_date()
     last_paper_date = old_date_record.last_paper - timedelta(days=1)
+    if 'start_date' in request.args:
+        last_paper_date = datetime.strptime(request.args['start_date'],
+                                            DATA_FORMAT
+                                            )
+
+    params = update_params(last_paper_date)
+    logging.info('Parameters: %s', params)
+
+    if PAPER_PARTITIONS:
+        ensure_partitions()
+        db.session.commit()
+
+    # further code is paper source independent.
+    # Any API can be defined above
+    update_papers([paper_api_from_args(last_paper_date)], **params)
+
+    # update the date record
+    last_paper = Paper.query.order_by(Paper.date_up.desc()).limit(1).first()
+    old_date_record.last_paper = last_paper.date_up
+    db.session.commit()
 
-    # update_papers() params
+    # the partitioned paper table doesn't need the cache
+    if not PAPER_PARTITIONS:
+        refresh_caches(old_date_record)
+
+    # the listings cached in all the workers are outdated
+    old_date_record.last_harvest = datetime.now()
+    db.session.commit()
+    listing_cache.clear()
+    feed_cache.clear()
+
+    # TODO move it to particular API
+    if abs(old_date_record.last_paper.hour - current_app.config['ARXIV_DEADLINE_TIME'].hour) > 1:
+        logging.warning('Last paper exceeds deadline limit! Consider deadline revision')
+        logging.warning('Last paper: %r\tDeadline: %r',
+                        last_paper_date,
+                        current_app.config['ARXIV_DEADLINE_TIME']
+                        )
+
+    return dumps({'success': True}), 201
+
+
+def update_params(last_paper_date: datetime) -> Dict:
+    """update_papers() params from the request arguments."""
     # by default updates are on
     params = {'do_update': True}
     if 'n_papers' in request.args:
         params['n_papers'] = int(request.args.get('n_papers'))
     if 'do_update' in request.args:
         params['do_update'] = request.args.get('do_update')
-    if 'start_date' in request.args:
-        last_paper_date = datetime.strptime(request.args['start_date'],
-                                            DATA_FORMAT
-                                            )
     params['last_paper_date'] = last_paper_date
+    # pipeline mode overlaps the download, parsing and DB insert
+    params['pipeline'] = bool(request.args.get('pipeline'))
+    # bulk mode stores every batch with a single upsert
+    # ON CONFLICT (paper_id) needs the unique paper_id, so not for the partitioned table
+    params['bulk'] = bool(request.args.get('bulk')) and not PAPER_PARTITIONS
+    return params
 
-    logging.info('Parameters: %s', params)
 
-    # initialise paper API
-    paper_api = ArxivOaiApi()
+def paper_api_from_args(last_paper_date: datetime) -> ArxivOaiApi:
+    """Initialise the paper API with the request arguments."""
+    # stream mode parses the pages while downloading
+    paper_api = ArxivOaiApi(stream=bool(request.args.get('stream')))
 
     # API cal params
     if request.args.get('set'):
@@ -95,54 +176,34 @@ def load_papers():
         paper_api.set_until(request.args['until'])
     else:
         paper_api.params.pop('until', None)
+    return paper_api
 
-    # further code is paper source independent.
-    # Any API can be defined above
-    update_papers([paper_api], **params)
 
-    # update the date record
-    last_paper = Paper.query.order_by(Paper.date_up.desc()).limit(1).first()
-    old_date_record.last_paper = last_paper.date_up
-    db.session.commit()
+def refresh_caches(old_date_record: UpdateDate):
+    """
+    Update the day and week caches after the last paper.
 
-    # update the cache
+    The caches are refreshed incrementally in one transaction
+    so the readers never see an empty cache.
+    """
     # Day cache
-    PaperCacheDay.query.delete()
-    keys = db.inspect(PaperCacheDay).columns.keys()
-    get_columns = lambda post: {key: getattr(post, key) for key in keys}
-
-    posts = Paper.query.filter(Paper.date_up > old_date_record.last_paper - timedelta(days=1))
-    db.session.bulk_insert_mappings(PaperCacheDay, (get_columns(post) for post in posts))
-    old_date_record.first_paper_day_cache = PaperCacheDay.query.order_by(
-        PaperCacheDay.date_up.asc()
-    ).limit(1).first().date_up
+    refresh_paper_cache(PaperCacheDay, old_date_record.last_paper - timedelta(days=1))
+    old_date_record.first_paper_day_cache = db.session.query(
+        func.min(PaperCacheDay.date_up)
+    ).scalar()
 
     # Week cache
-    PaperCacheWeeks.query.delete()
-    keys = db.inspect(PaperCacheWeeks).columns.keys()
-    get_columns = lambda post: {key: getattr(post, key) for key in keys}
-
-    posts = Paper.query.filter(Paper.date_up > old_date_record.last_paper - timedelta(days=14))
-    db.session.bulk_insert_mappings(PaperCacheWeeks, (get_columns(post) for post in posts))
-    old_date_record.first_paper_weeks_cache = PaperCacheWeeks.query.order_by(
-        PaperCacheWeeks.date_up.asc()
-    ).limit(1).first().date_up
+    refresh_paper_cache(PaperCacheWeeks, old_date_record.last_paper - timedelta(days=14))
+    old_date_record.first_paper_weeks_cache = db.session.query(
+        func.min(PaperCacheWeeks.date_up)
+    ).scalar()
 
     db.session.commit()
 
-    # TODO move it to particular API
-    if abs(old_date_record.last_paper.hour - current_app.config['ARXIV_DEADLINE_TIME'].hour) > 1:
-        logging.warning('Last paper exceeds deadline limit! Consider deadline revision')
-        logging.warning('Last paper: %r\tDeadline: %r',
-                        last_paper_date,
-                        current_app.config['ARXIV_DEADLINE_TIME']
-                        )
-
-    return dumps({'success': True}), 201
-
 
 @auto_bp.route('/delete_papers', methods=['POST'])
 @check_token
+@queued
 def delete_papers():
     """Clean up paper table."""
     logging.info('Start paper delete')
@@ -171,8 +232,17 @@ def delete_papers():
     #  Paper.date_up < until_date)
     logging.info('Deleting %i papers', len(to_delete.all()))
     n_deleted = len(to_delete.all())
+    job_progress(deleted=n_deleted)
     to_delete.delete(synchronize_session=False)
+    # the partitioned table has no foreign key to cascade the delete
+    if PAPER_PARTITIONS:
+        db.session.execute(paper_associate.delete().where(
+            paper_associate.columns.paper_ref_id.not_in(db.session.query(Paper.id))
+        ))
+    get_old_update_date().last_harvest = datetime.now()
     db.session.commit()
+    listing_cache.clear()
+    feed_cache.clear()
 
     logging.info('All papers until %r are deleted.', until_date)
 
@@ -219,22 +289,20 @@ def bookmark_user():
         rule = tag.rule
 
     old_date = datetime.now() - timedelta(weeks=weeks)
-    papers = Paper.query.filter(Paper.cats.overlap(usr.arxiv_cat),
-                                Paper.date_up > old_date
-                                ).order_by(Paper.date_up).all()
+    paper_query = Paper.query.filter(Paper.cats.overlap(usr.arxiv_cat),
+                                     Paper.date_up > old_date
+                                     )
+    # filter in the DB what could be translated to SQL
+    rule_filter = compile_rule(rule).to_sql(Paper)
+    if rule_filter is not None:
+        paper_query = paper_query.filter(rule_filter)
+    papers = paper_query.order_by(Paper.date_up).all()
 
     paper_list = get_or_create_list(usr.id, name)
 
-    for paper in papers:
-        if tag_suitable(PaperInterface.from_paper(paper), rule):
-            # check if paper is already there to prevent duplication
-            result = db.session.query(paper_associate
-                                      ).filter_by(list_ref_id=paper_list.id,
-                                                  paper_ref_id=paper.id
-                                                  ).first()
-            if not result:
-                paper_list.papers.append(paper)
-                paper_list.not_seen += 1
+    found = evaluate_rule_batch(rule, [PaperInterface.from_paper(paper) for paper in papers])
+    # the papers already in the list are skipped
+    add_list_papers([(paper_list.id, paper.id) for paper, suits in zip(papers, found) if suits])
 
     db.session.commit()
     return dumps({'success': True}), 201
@@ -242,24 +310,34 @@ def bookmark_user():
 
 @auto_bp.route('/bookmark_papers', methods=['POST'])
 @check_token
+@queued
 def bookmark_papers():
     """
     Auto bookmark new submissions.
 
     1. Start with querying all the tags with bookmark==True
         sort by user id
-    2. User by user:
-        2.1 Get a user that owns this tag
-        2.2 Get cats this user is interested in
-        2.3 Query papers since last run with the categories of a given user
-    3. tag by tag:
-        3.1 Check that for a given user paper list exists. If not -- create
-        3.2 Paper by paper:
-            3.2.1 Check if tag_suitable -- add paper to the list
+    2. Query papers since last run with the categories of all the users once
+    3. User by user:
+        3.1 Get a user that owns this tag
+        3.2 Take the papers of the user categories from the index
+    4. tag by tag:
+        4.1 Check that for a given user paper list exists. If not -- create
+        4.2 Paper by paper:
+            4.2.1 Check if the paper suits the tag rule -- collect the paper for the list
+    5. Add the collected papers to the lists in bulk
     """
-    logging.info('Start paper bookmark update')
+    start = perf_counter()
+    try:
+        shard, shards = get_shard()
+    except ValueError:
+        logging.exception('Wrong bookmark shard %r', request.args)
+        return dumps({'success': False}), 422
+    logging.info('Start paper bookmark update, shard %i of %i', shard, shards)
 
-    tags = Tag.query.filter_by(bookmark=True).order_by(Tag.user_id).all()
+    tags = Tag.query.filter_by(bookmark=True).filter(
+        Tag.user_id % shards == shard
+    ).order_by(Tag.user_id).all()
 
     # the date until one the papers will be processed
     old_date_record = get_old_update_date()
@@ -270,135 +348,265 @@ def bookmark_papers():
                                      DATA_FORMAT
                                      )
 
+    # all the shards process the papers until the same date
+    try:
+        until = start_shard_run('bookmark', old_date, shards)
+    except ValueError:
+        logging.exception('Wrong bookmark shard %r', request.args)
+        return dumps({'success': False}), 422
+
+    # user --> rules of all the bookmark tags
+    user_rules = {}
+    for tag in tags:
+        user_rules.setdefault(tag.user_id, []).append(tag.rule)
+
+    users = get_users(user_rules.keys())
+    # 2. skip in the DB papers that can't suit any of the bookmark tags
+    index = CategoryIndex.load(all_cats(users.values()),
+                               old_date,
+                               rules_to_sql([tag.rule for tag in tags], Paper),
+                               until
+                               )
+
+    n_user, n_papers = bookmark_users(tags, users, index)
+
+    finished = close_shard('bookmark', old_date_record, old_date, until, (shard, shards))
+    logging.info('Done with bookmarks. Users %r, papers %s',
+                 n_user,
+                 n_papers
+                 )
+    log_index(index)
+    logging.debug('Tag rule cache: %r', rule_cache.info())
+
+    return dumps(shard_report(shard, shards, n_user, n_papers, index, start, finished)), 201
+
+
+def bookmark_users(tags: List[Tag],
+                   users: Dict[int, User],
+                   index: CategoryIndex
+                   ) -> Tuple[int, int]:
+    """
+    Bookmark the papers suitable with the tags, steps 3-5 of bookmark_papers().
+
+    The tags are sorted by the user id.
+    Return the number of users and the number of the added bookmarks.
+    """
     prev_user = -1
 
     n_user = 0
-    n_papers = 0
+    # (list id, paper id) added at the end
+    bookmarks = []
     papers = []
+    corpus = PaperCorpus(papers)
     for tag in tags:
-        # 2
+        # 3
         if tag.user_id != prev_user:
             logging.debug('Bookmark for user %i', tag.user_id)
-            user = User.query.filter_by(id=tag.user_id).first()
-            # 2.3 query papers with user's cats
-            papers = Paper.query.filter(Paper.cats.overlap(user.arxiv_cat),
-                                        Paper.date_up > old_date
-                                        ).order_by(Paper.date_up).all()
+            papers, corpus = index.get(users[tag.user_id].arxiv_cat)
             prev_user = tag.user_id
             n_user += 1
-        # 3.1
+            job_progress(users=n_user, users_total=len(users))
+        # 4.1
         paper_list = get_or_create_list(prev_user, tag.name)
 
-        # 3.2
-        for paper in papers:
-            if tag_suitable(PaperInterface.from_paper(paper), tag.rule):
-                # check if paper is already there to prevent duplication
-                result = db.session.query(paper_associate
-                                          ).filter_by(list_ref_id=paper_list.id,
-                                                      paper_ref_id=paper.id
-                                                      ).first()
-                if not result:
-                    paper_list.papers.append(paper)
-                    n_papers += 1
-                    paper_list.not_seen += 1
-
-    # store the last checked paper
-    last_paper = Paper.query.order_by(Paper.date_up.desc()).first()
-    old_date_record.last_bookmark = last_paper.date_up
-    db.session.commit()
-    logging.info('Done with bookmarks. Users %r, papers %s',
-                 n_user,
-                 n_papers
-                 )
+        # 4.2
+        found = compile_rule(tag.rule).evaluate_batch(corpus)
+        bookmarks.extend((paper_list.id, paper.id) for paper, suits in zip(papers, found) if suits)
 
-    return dumps({'success': True}), 201
+    # 5. the papers already in the lists are skipped
+    return n_user, sum(add_list_papers(bookmarks).values())
 
 
 @auto_bp.route('/email_papers', methods=['POST'])
 @check_token
+@queued
 def email_papers():
     """
     Email notifications about new submissions.
 
     1. Start with querying all the tags with email==True
         sort by user id
-    2. User by user:
-        2.1 Get a user that owns this tag
-        2.2 Get cats this user is interested in
-        2.3 Query papers since last run with the categories of a given user
-    3. papers_to_send = []. tag by tag:
-        3.1 Paper by paper:
-            3.2.1 Check if tag_suitable -- add paper to the papers_to_send
-    4. Render email with papers_to_send and send.
+    2. Query papers since last run with the categories of all the users once
+    3. User by user:
+        3.1 Get a user that owns this tag
+        3.2 Take the papers of the user categories from the index
+    4. papers_to_send = []. tag by tag:
+        4.1 Paper by paper:
+            4.1.1 Check if the paper suits the tag rule -- add paper to the papers_to_send
+    5. Render email with papers_to_send and send.
     """
-    do_send = request.args.get('do_send')
-    logging.info('Start paper email sending update do_send=%r', do_send)
+    start = perf_counter()
+    do_send = str(request.args.get('do_send')).lower() == 'true'
+    try:
+        shard, shards = get_shard()
+    except ValueError:
+        logging.exception('Wrong email shard %r', request.args)
+        return dumps({'success': False}), 422
+    logging.info('Start paper email sending update do_send=%r, shard %i of %i',
+                 do_send,
+                 shard,
+                 shards
+                 )
 
-    tags = Tag.query.filter_by(email=True).order_by(Tag.user_id,
-                                                    Tag.order
-                                                    ).all()
+    tags = Tag.query.filter_by(email=True).filter(
+        Tag.user_id % shards == shard
+    ).order_by(Tag.user_id, Tag.order).all()
 
     # the date until one the papers will be processed
     old_date_record = get_old_update_date()
     old_date = old_date_record.last_email
 
-    prev_user = -1
-    papers_to_send = []
-    n_user = 0
-    n_papers = 0
-    user = None
-    papers = []
-    for tag in tags:
-        # 2
-        if tag.user_id != prev_user:
-            # 4. send papers. If tags['papers'] is empty
-            #  --> the first user is processing
-            if any([len(tags['papers']) > 0 for tags in papers_to_send]) \
-                    and user:
-                logging.debug('Send email for user %i', user.id)
-                email_paper_update(papers_to_send,
-                                   user.email,
-                                   bool(do_send.lower() == "true") and user.verified_email
-                                   )
-
-            user = User.query.filter_by(id=tag.user_id).first()
-            logging.debug('Form the email for user %i', user.id)
-            # 2.3 query papers with user's cats
-            papers = Paper.query.filter(Paper.cats.overlap(user.arxiv_cat),
-                                        Paper.date_up > old_date
-                                        ).order_by(Paper.date_up).all()
+    # all the shards process the papers until the same date
+    try:
+        until = start_shard_run('email', old_date, shards)
+    except ValueError:
+        logging.exception('Wrong email shard %r', request.args)
+        return dumps({'success': False}), 422
 
-            prev_user = tag.user_id
-            n_user += 1
-            papers_to_send = []
-
-        papers_to_send.append({'tag': tag.name,
-                               'papers': []
-                               })
-        # 3.2
-        for paper in papers:
-            if tag_suitable(PaperInterface.from_paper(paper), tag.rule):
-                papers_to_send[-1]['papers'].append(paper)
-                n_papers += 1
-
-    # for the last user
-    if any([len(tags['papers']) > 0 for tags in papers_to_send]):
-        logging.debug('Send email for user %i', user.id)
-        email_paper_update(papers_to_send,
-                           user.email,
-                           bool(do_send == "True") and user.verified_email
-                           )
+    users = get_users({tag.user_id for tag in tags})
+    # 2
+    index = CategoryIndex.load(all_cats(users.values()), old_date, until=until)
 
-    # store the last checked paper
-    last_paper = Paper.query.order_by(Paper.date_up.desc()).first()
-    old_date_record.last_email = last_paper.date_up
-    db.session.commit()
+    n_user, n_papers = email_users(tags, users, index, do_send)
+
+    finished = close_shard('email', old_date_record, old_date, until, (shard, shards))
 
     logging.info('Done with emails. Users %r, papers %s',
                  n_user,
                  n_papers
                  )
-    return dumps({'success': True}), 201
+    log_index(index)
+    logging.debug('Tag rule cache: %r', rule_cache.info())
+    return dumps(shard_report(shard, shards, n_user, n_papers, index, start, finished)), 201
+
+
+def email_users(tags: List[Tag],
+                users: Dict[int, User],
+                index: CategoryIndex,
+                do_send: bool
+                ) -> Tuple[int, int]:
+    """
+    Email the papers suitable with the tags, steps 3-5 of email_papers().
+
+    The tags are sorted by the user id.
+    Return the number of users and the number of the found papers.
+    """
+    n_user = 0
+    n_papers = 0
+    for user_id, user_tags in groupby(tags, key=lambda tag: tag.user_id):
+        # 3
+        user = users[user_id]
+        logging.debug('Form the email for user %i', user.id)
+        papers, corpus = index.get(user.arxiv_cat)
+        n_user += 1
+        job_progress(users=n_user, users_total=len(users))
+
+        papers_to_send = []
+        for tag in user_tags:
+            # 4.1
+            found = compile_rule(tag.rule).evaluate_batch(corpus)
+            tag_papers = [paper for paper, suits in zip(papers, found) if suits]
+            papers_to_send.append({'tag': tag.name,
+                                   'papers': tag_papers
+                                   })
+            n_papers += len(tag_papers)
+
+        # 5. no email without papers
+        if any(len(to_send['papers']) > 0 for to_send in papers_to_send):
+            logging.debug('Send email for user %i', user.id)
+            email_paper_update(papers_to_send,
+                               user.email,
+                               do_send and user.verified_email
+                               )
+    return n_user, n_papers
+
+
+def get_shard() -> Tuple[int, int]:
+    """
+    Shard of the job and the number of shards from the request, e.g. ?shard=0&shards=4.
+
+    The users are split between the shards by id.
+    """
+    shards = int(request.args.get('shards', 1))
+    shard = int(request.args.get('shard', 0))
+    if shards < 1 or not 0 <= shard < shards:
+        raise ValueError(f'Shard {shard} of {shards} is out of range')
+    return shard, shards
+
+
+def close_shard(job: str,
+                record: UpdateDate,
+                since: datetime,
+                until: Optional[datetime],
+                shard: Tuple[int, int]
+                ) -> bool:
+    """
+    Mark the shard of the job run as done and commit.
+
+    The last checked paper of the job (last_bookmark, last_email) is stored
+    when all the shards are done.
+    True if all the shards are done.
+    """
+    finished = finish_shard(job, since, *shard)
+    if finished and until:
+        setattr(record, f'last_{job}', until)
+    db.session.commit()
+    return finished
+
+
+def shard_report(shard: int,
+                 shards: int,
+                 n_user: int,
+                 n_papers: int,
+                 index: CategoryIndex,
+                 start: float,
+                 finished: bool
+                 ) -> Dict:
+    """Timing of the job shard."""
+    seconds = perf_counter() - start
+    logging.info('Shard %i of %i: %i users in %.3fs, papers fetched in %.3fs. All shards done: %r',
+                 shard,
+                 shards,
+                 n_user,
+                 seconds,
+                 index.load_time,
+                 finished
+                 )
+    return {'success': True,
+            'shard': shard,
+            'shards': shards,
+            'users': n_user,
+            'papers': n_papers,
+            'fetch_seconds': index.load_time,
+            'seconds': seconds,
+            'finished': finished
+            }
+
+
+def get_users(user_ids) -> Dict[int, User]:
+    """Users by id in one query."""
+    return {user.id: user for user in User.query.filter(User.id.in_(list(user_ids))).all()}
+
+
+def all_cats(users) -> List[str]:
+    """Union of the user categories."""
+    return sorted({cat for user in users for cat in user.arxiv_cat or []})
+
+
+def log_index(index: CategoryIndex):
+    """Log the queries saved by the shared paper fetch."""
+    info = index.info()
+    # a user and a paper query per user are replaced by the two queries
+    queries_saved = info['queries_saved'] + max(info['requests'] - 1, 0)
+    logging.info('New papers %i fetched in %.3fs for %i requests in %i category groups. '
+                 'DB queries saved: %i, seconds saved: ~%.3f',
+                 info['papers'],
+                 index.load_time,
+                 info['requests'],
+                 info['groups'],
+                 queries_saved,
+                 info['seconds_saved']
+                 )
 
 
 def email_paper_update(papers: List, email: str, do_send: bool):
@@ -466,6 +674,32 @@ def rss_feed(token):
     print('Checking user ', data['user'])
     user = User.query.filter_by(email=data['user']).first()
 
+    # use only RSS tags for speedup
+    tags = Tag.query.filter_by(user_id=user.id, userss=True).order_by(Tag.order).all()
+
+    # the feed is the same until the harvest or the user settings change
+    # the 2 weeks window moves every day
+    etag = listing_etag(tags, user.arxiv_cat, datetime.now().date(), request.headers.get('Host'))
+    unchanged = not_modified(etag)
+    if unchanged:
+        return unchanged
+
+    feed = feed_cache.get(user.id, etag)
+    if feed is None:
+        feed = render_feed(token, user, tags)
+        feed_cache.put(user.id, etag, feed)
+    logging.debug('RSS feed cache %s', feed_cache.info())
+
+    # return a feed
+    response = make_response(feed)
+    response.headers.set('Content-Type', 'application/rss+xml')
+    set_etag(response, etag)
+
+    return response
+
+
+def render_feed(token: str, user: User, tags: List[Tag]) -> bytes:
+    """Render the RSS feed of the papers with the user RSS tags."""
     # create feed generator
     fg = FeedGenerator()
     fg.title('arXiv tag RSS feed')
@@ -476,14 +710,18 @@ def rss_feed(token):
     new_date = datetime.now()
     old_date = new_date - timedelta(days=14)
 
-    response = PaperResponse(old_date)
-    response.papers = get_papers(user.arxiv_cat, old_date, new_date)
-
     tag_list = []
-    # use only RSS tags for speedup
-    tags = Tag.query.filter_by(user_id=user.id, userss=True).order_by(Tag.order).all()
     for tag in tags:
         tag_list.append(TagInterface.from_tag(tag))
+
+    response = PaperResponse(old_date)
+    # the abstracts are loaded for the tags or for the feed entries only
+    response.papers = get_papers(user.arxiv_cat,
+                                 old_date,
+                                 new_date,
+                                 rules_need_abstract([tag.rule for tag in tag_list]),
+                                 cached=False
+                                 )
     # assign tags
     process_papers(response,
                    tag_list,
@@ -493,6 +731,7 @@ def rss_feed(token):
                    )
 
     response.sort_papers()
+    load_abstracts([paper for paper in response.papers if len(paper.tags) > 0])
     # Add entries to feed
     for paper in response.papers:
         # only if one of the RSS tags is assigned
@@ -511,8 +750,4 @@ def rss_feed(token):
                      'title': 'Link to arXiv'
                      })
 
-    # return a feed
-    response = make_response(fg.rss_str())
-    response.headers.set('Content-Type', 'application/rss+xml')
-
-    return response
+    return fg.rss_str()
@@ -88,6 +88,22 @@ class PaperInterface:
                               paper_db.source
                               )
 
+    @classmethod
+    def from_row(cls, row):
+        """Create from the projection row, the abstract is optional."""
+        return PaperInterface(row.id,
+                              row.paper_id,
+                              row.title,
+                              row.author,
+                              row.date_up,
+                              row.date_sub,
+                              row.version,
+                              row.doi,
+                              getattr(row, 'abstract', None),
+                              row.cats,
+                              row.source
+                              )
+
 
 class TagInterface:
     """Interface for the tag."""
@@ -173,6 +189,8 @@ class PaperResponse:
         self.last_date = date
         self.title = ''
         self.lists = []
+        # cursor of the next page for the paginated response
+        self.cursor = None
 
     @staticmethod
     def key_tag(paper: PaperInterface) -> Tuple[int, datetime]:
@@ -250,7 +268,8 @@ class PaperResponse:
                 'ntag': self.ntag,
                 'nnov': self.nnov,
                 'title': self.title,
-                'lists': self.lists
+                'lists': self.lists,
+                'cursor': self.cursor
                 }
 
 
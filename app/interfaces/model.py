@@ -2,9 +2,17 @@
 
 from flask_login import UserMixin
 
+from sqlalchemy import event, DDL
 from sqlalchemy.dialects import postgresql as pg
+from sqlalchemy.orm import declared_attr, validates, foreign
 
 from app import db
+from configmodule import Config
+
+# the paper table is partitioned on date_up, see app/partitions.py
+# the partition key is a part of every unique constraint and the table can't be referenced
+# the only source of the setting for the schema and the code
+PAPER_PARTITIONS = Config.PAPER_PARTITIONS
 
 
 class User(UserMixin, db.Model):
@@ -151,7 +159,98 @@ class UpdateDate(db.Model):
     first_paper_weeks_cache = db.Column(db.DateTime(),
                                         nullable=True
                                         )
+    # the paper table change time, e.g. the end of the harvest
+    # the listing caches are keyed by it
+    last_harvest = db.Column(db.DateTime(),
+                             nullable=True
+                             )
+
+
+class ShardRun(db.Model):
+    """
+    Sharded run of a notification job, e.g. bookmark or email.
+
+    All the shards of the run process the papers between since and until.
+    The job watermark is moved to until when all the shards are done.
+    """
+    __tablename__ = 'shard_runs'
+    job = db.Column(db.String(),
+                    primary_key=True
+                    )
+    # the job watermark at the run start
+    since = db.Column(db.DateTime(),
+                      primary_key=True
+                      )
+    shards = db.Column(db.Integer,
+                       nullable=False
+                       )
+    until = db.Column(db.DateTime(),
+                      nullable=True
+                      )
+    done = db.Column(pg.ARRAY(db.Integer, dimensions=1),
+                     nullable=False,
+                     default=[]
+                     )
+
 
+class Job(db.Model):
+    """
+    Background job of the local queue, e.g. the paper harvest.
+
+    The job is a hook called by the worker with the stored request arguments.
+    """
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer,
+                   primary_key=True
+                   )
+    # endpoint of the hook, e.g. auto_bp.load_papers
+    name = db.Column(db.String(),
+                     nullable=False
+                     )
+    args = db.Column(pg.JSONB,
+                     nullable=False,
+                     default={}
+                     )
+    # host URL of the queuing request, e.g. for the links in the emails
+    host = db.Column(db.String(),
+                     nullable=True
+                     )
+    # queued --> running --> done or failed
+    status = db.Column(db.String(),
+                       nullable=False,
+                       default='queued',
+                       index=True
+                       )
+    # counters reported by the hook, e.g. harvested papers
+    progress = db.Column(pg.JSONB,
+                         nullable=False,
+                         default={}
+                         )
+    result = db.Column(pg.JSONB,
+                       nullable=True
+                       )
+    error = db.Column(db.Text,
+                      nullable=True
+                      )
+    created = db.Column(db.DateTime(),
+                        nullable=False
+                        )
+    started = db.Column(db.DateTime(),
+                        nullable=True
+                        )
+    # updated by the worker while the job is running
+    heartbeat = db.Column(db.DateTime(),
+                          nullable=True
+                          )
+    finished = db.Column(db.DateTime(),
+                         nullable=True
+                         )
+
+
+# the partitioned paper table can't be referenced
+PAPER_REF = [] if PAPER_PARTITIONS else [db.ForeignKey('papers.id',
+                                                       ondelete='CASCADE'
+                                                       )]
 
 # helper table to deal with many-to-many relations
 # lists --> papers
@@ -166,9 +265,7 @@ paper_associate = db.Table('paper_associate',
                                      ),
                            db.Column('paper_ref_id',
                                      db.Integer,
-                                     db.ForeignKey('papers.id',
-                                                   ondelete='CASCADE'
-                                                   ),
+                                     *PAPER_REF,
                                      primary_key=True
                                      )
                            )
@@ -225,15 +322,110 @@ class PaperModel(object):
                        nullable=False
                        )
 
+    # lowercase author list for the trigram index
+    # filled automatically when the author list is set
+    author_text = db.Column(db.String(),
+                            nullable=True
+                            )
+
+    @declared_attr
+    def __table_args__(cls):
+        """Indices of the paper tables."""
+        return cls.paper_indexes()
+
+    @classmethod
+    def paper_indexes(cls) -> tuple:
+        """Indices of the paper table."""
+        return (db.Index(f'ix_{cls.__tablename__}_author_text',
+                         'author_text',
+                         postgresql_using='gin',
+                         postgresql_ops={'author_text': 'gin_trgm_ops'}
+                         ),
+                # papers without the author text, empty after "flask papers fill-authors"
+                # the author rules check them apart, so the trigram index is still used
+                db.Index(f'ix_{cls.__tablename__}_author_text_null',
+                         'id',
+                         postgresql_where=db.text('author_text IS NULL')
+                         ),
+                # category overlap of the listings and the bookmark jobs
+                db.Index(f'ix_{cls.__tablename__}_cats',
+                         'cats',
+                         postgresql_using='gin'
+                         ),
+                # date ranges of the listings
+                db.Index(f'ix_{cls.__tablename__}_date_up',
+                         'date_up'
+                         ),
+                )
+
+    @validates('author')
+    def validate_author(self, key, author):
+        """Keep the author search text in sync with the author list."""
+        self.author_text = join_authors(author)
+        return author
+
     def __repr__(self):
         """Print paper."""
         return f'<Paper id: {self.id} title: {self.title}>'
 
 
+def join_authors(author) -> str:
+    """Author list as a lowercase string for the search."""
+    if author is None:
+        return None
+    return ', '.join(author).lower()
+
+
+# trigram operators for the text indexes
+event.listen(db.Model.metadata,
+             'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+             )
+
+
 class Paper(PaperModel, db.Model):
     """The actual paper table."""
     __tablename__ = 'papers'
 
+    @classmethod
+    def paper_indexes(cls) -> tuple:
+        """Indices of the paper table, title and abstract are filtered with the tag rules."""
+        # the bookmark jobs prefilter the papers with the case-insensitive regex, see rules_to_sql
+        return super().paper_indexes() + (db.Index(f'ix_{cls.__tablename__}_title',
+                                                   'title',
+                                                   postgresql_using='gin',
+                                                   postgresql_ops={'title': 'gin_trgm_ops'}
+                                                   ),
+                                          db.Index(f'ix_{cls.__tablename__}_abstract',
+                                                   'abstract',
+                                                   postgresql_using='gin',
+                                                   postgresql_ops={'abstract': 'gin_trgm_ops'}
+                                                   ),
+                                          )
+
+    if PAPER_PARTITIONS:
+        # the primary key is (id, date_up), see __table_args__
+        id = db.Column(db.Integer,
+                       autoincrement=True
+                       )
+
+        paper_id = db.Column(db.String(),
+                             nullable=False
+                             )
+
+        @declared_attr
+        def __table_args__(cls):
+            """Indices of the paper table, the keys include the partition key."""
+            return cls.paper_indexes() + (db.PrimaryKeyConstraint('id',
+                                                                  'date_up',
+                                                                  name='papers_pkey'
+                                                                  ),
+                                          db.UniqueConstraint('paper_id',
+                                                              'date_up',
+                                                              name='papers_paper_id_key'
+                                                              )
+                                          )
+
 
 class PaperCacheDay(PaperModel, db.Model):
     """Table for paper caching for a day."""
@@ -275,6 +467,11 @@ class PaperList(db.Model):
 
     papers = db.relationship('Paper',
                              secondary=paper_associate,
+                             # no foreign key to the partitioned table
+                             secondaryjoin=(
+                                 Paper.id == foreign(paper_associate.columns.paper_ref_id)
+                                 if PAPER_PARTITIONS else None
+                             ),
                              lazy='subquery',
                              backref=db.backref('paper_list', lazy=True)
                              )
@@ -0,0 +1,199 @@
+"""
+Local background job queue backed by the jobs table.
+
+With JOB_QUEUE=True the hooks e.g. load_papers are put to the queue
+and answer with the job id immediately. The jobs are run by the workers
+flask jobs worker         -- poll the queue and run the jobs
+flask jobs worker --once  -- run the queued jobs and exit
+The workers claim the jobs with SELECT ... FOR UPDATE SKIP LOCKED,
+so any number of them could run in parallel. No external broker is needed.
+The running job gets a heartbeat every JOB_HEARTBEAT seconds. The jobs
+without a heartbeat for JOB_TIMEOUT seconds are marked failed by the next claim.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from json import loads
+from threading import Thread, Event
+from time import sleep
+from typing import Dict, Optional
+
+import click
+from flask import Flask, current_app, g, make_response
+from flask.cli import AppGroup
+from sqlalchemy import func
+
+from .interfaces.model import db, Job
+
+jobs_cli = AppGroup('jobs', help='Run the background jobs.')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def enqueue_job(name: str, args: Dict, host: Optional[str] = None) -> Job:
+    """Put the hook with the request arguments and the host URL to the queue."""
+    job = Job(name=name,
+              args=args,
+              host=host,
+              status=QUEUED,
+              progress={},
+              created=datetime.now()
+              )
+    db.session.add(job)
+    db.session.commit()
+    logging.info('Job %i %s is queued with %r', job.id, name, args)
+    return job
+
+
+def fail_lost_jobs() -> int:
+    """
+    Mark failed the running jobs without a heartbeat for JOB_TIMEOUT seconds.
+
+    E.g. the worker is killed.
+    """
+    now = datetime.now()
+    limit = now - timedelta(seconds=current_app.config['JOB_TIMEOUT'])
+    lost = Job.query.filter(Job.status == RUNNING,
+                            func.coalesce(Job.heartbeat, Job.started) < limit
+                            ).with_for_update(skip_locked=True).all()
+    for job in lost:
+        last_beat = job.heartbeat or job.started
+        logging.error('Job %i %s has no heartbeat since %s', job.id, job.name, last_beat)
+        job.status = FAILED
+        job.error = f'No heartbeat since {last_beat.isoformat()}, the worker is lost'
+        job.finished = now
+    db.session.commit()
+    return len(lost)
+
+
+def claim_job() -> Optional[Job]:
+    """
+    Take the oldest queued job.
+
+    The row lock is skipped by the other workers and released with the status change.
+    """
+    fail_lost_jobs()
+    job = Job.query.filter_by(status=QUEUED).order_by(Job.id
+                                                      ).with_for_update(skip_locked=True).first()
+    if job:
+        job.status = RUNNING
+        job.started = datetime.now()
+        job.heartbeat = job.started
+    db.session.commit()
+    return job
+
+
+def heartbeat(app: Flask, job_id: int, stop: Event):
+    """Update the job heartbeat in a separate transaction until the job is finished."""
+    jobs = Job.__table__
+    with app.app_context():
+        while not stop.wait(app.config['JOB_HEARTBEAT']):
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(jobs.update().where(jobs.columns.id == job_id
+                                                           ).values(heartbeat=datetime.now()))
+            except Exception:  # pylint: disable=broad-except
+                logging.exception('Job %i heartbeat failed', job_id)
+
+
+def run_job(app: Flask, job: Job):
+    """
+    Call the job hook in the request context with the stored arguments.
+
+    The request is made to the host of the queuing request, so the hook links point to it.
+    """
+    job_id = job.id
+    name = job.name
+    host = job.host
+    args = job.args
+    logging.info('Job %i %s is started', job_id, name)
+    stop = Event()
+    beat = Thread(target=heartbeat, args=(app, job_id, stop), daemon=True)
+    beat.start()
+    # a fresh app context per job, so g and the session are not shared
+    # with the caller or the previous job
+    with app.app_context(), app.test_request_context(base_url=host,
+                                                     method='POST',
+                                                     query_string=args,
+                                                     headers={'token': app.config['TOKEN']}
+                                                     ):
+        g.job_id = job_id
+        g.job_progress = {}
+        result = None
+        error = None
+        try:
+            response = make_response(app.view_functions[name]())
+            try:
+                result = loads(response.get_data(as_text=True))
+            except ValueError:
+                result = {'response': response.get_data(as_text=True)}
+            status = DONE if response.status_code < 400 else FAILED
+        except Exception as err:  # pylint: disable=broad-except
+            logging.exception('Job %i %s failed', job_id, name)
+            db.session.rollback()
+            status = FAILED
+            error = repr(err)
+        finally:
+            stop.set()
+            beat.join()
+
+        job = db.session.get(Job, job_id)
+        job.status = status
+        job.result = result
+        job.error = error
+        job.progress = g.job_progress
+        job.finished = datetime.now()
+        db.session.commit()
+    logging.info('Job %i is %s', job_id, status)
+
+
+def run_next_job(app: Flask) -> bool:
+    """Run the oldest queued job. False if the queue is empty."""
+    job = claim_job()
+    if not job:
+        return False
+    run_job(app, job)
+    return True
+
+
+def job_info(job: Job) -> Dict:
+    """Job status with the progress and durations."""
+    def seconds(start: Optional[datetime], end: Optional[datetime]) -> Optional[float]:
+        if start is None:
+            return None
+        return ((end or datetime.now()) - start).total_seconds()
+
+    return {'id': job.id,
+            'name': job.name,
+            'args': job.args,
+            'host': job.host,
+            'status': job.status,
+            'progress': job.progress,
+            'result': job.result,
+            'error': job.error,
+            'created': job.created.isoformat(),
+            'started': job.started.isoformat() if job.started else None,
+            'heartbeat': job.heartbeat.isoformat() if job.heartbeat else None,
+            'finished': job.finished.isoformat() if job.finished else None,
+            'wait_seconds': seconds(job.created, job.started),
+            'run_seconds': seconds(job.started, job.finished)
+            }
+
+
+@jobs_cli.command('worker')
+@click.option('--once', is_flag=True, help='Run the queued jobs and exit.')
+def worker_command(once):
+    """Poll the queue and run the jobs."""
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    n_jobs = 0
+    while True:
+        if run_next_job(app):
+            n_jobs += 1
+        elif once:
+            break
+        else:
+            sleep(app.config['JOB_POLL'])
+    click.echo(f'{n_jobs} jobs done')
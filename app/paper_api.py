@@ -2,9 +2,10 @@
 
 import logging
 from datetime import datetime, timedelta, time, date, timezone
-from re import split
+from re import split, compile as re_compile
 from time import sleep
-from typing import Tuple, Generator, List
+from typing import Tuple, Generator, List, Optional
+from xml.sax.saxutils import unescape
 
 import defusedxml.ElementTree as ET
 import urllib3
@@ -15,6 +16,13 @@ from .interfaces.model import Paper
 from .utils import fix_xml
 
 
+class PageInterrupted(Exception):
+    """The streamed page is broken after n_records records."""
+    def __init__(self, n_records: int):
+        super().__init__(f'Page is broken after {n_records} records')
+        self.n_records = n_records
+
+
 class ArxivOaiApi:
     """
     Arxiv.org harvester with  OAI_PMH v2.0.
@@ -36,11 +44,20 @@ class ArxivOaiApi:
 
     OAI = "{http://www.openarchives.org/OAI/2.0/}"
     ARXIV = "{http://arxiv.org/OAI/arXivRaw/}"
+    TOKEN = re_compile(rb'<resumptionToken[^>]*>([^<]*)</resumptionToken>')
 
-    def __init__(self):
-        """API initialisation."""
+    def __init__(self, stream: bool = False):
+        """
+        API initialisation.
+
+        With stream=True the response is parsed while it is downloaded
+        and the papers are yielded record by record.
+        """
         self.params = ArxivOaiApi.DEF_PARAMS
         self.fail_attempts = 0
+        self.stream = stream
+        # update date of the last parsed paper
+        self.last_date = 'null'
 
     def set_set(self, set_var: str):
         """Set for papers."""
@@ -65,17 +82,67 @@ class ArxivOaiApi:
         return cls.BASE_URL + '/abs/' + pid + version
 
     def download_papers(self, rest: int = -1) -> Generator[Paper, None, None]:
-        """Generator for paper downloading."""
-
-        if self.fail_attempts > self.MAX_FAIL:
-            logging.error('arXiv exceeds max allowed error limit')
-            return
+        """
+        Generator for paper downloading.
 
+        Pages are requested one by one following the resumption token.
+        Failed requests are repeated until MAX_FAIL attempts are exceeded.
+        """
         logging.debug('Start harvesting')
 
-        response = None
+        # records of the current page yielded before the stream was broken
+        page_done = 0
+        while True:
+            if self.fail_attempts > self.MAX_FAIL:
+                logging.error('arXiv exceeds max allowed error limit')
+                return
+
+            response = self.request_page()
+            if response is None:
+                continue
+
+            logging.info('Ask arxiv with %r', response.url)
+
+            if self.stream:
+                try:
+                    n_records, token, list_size = yield from self.stream_page(response, page_done)
+                except PageInterrupted as interrupted:
+                    logging.warning('%s: %r', interrupted, interrupted.__cause__)
+                    page_done = max(page_done, interrupted.n_records)
+                    sleep(self.DELAY)
+                    self.fail_attempts += 1
+                    continue
+                page_done = 0
+            else:
+                n_records, token, list_size = yield from self.read_page(response)
+
+            if n_records != self.BATCH_SIZE and n_records != rest:
+                logging.warning('Download incomplete. Got %i from %i or %i',
+                                n_records,
+                                self.BATCH_SIZE,
+                                rest
+                                )
+
+            # check if the next call is required
+            if token is None:
+                return
+
+            rest = list_size % self.BATCH_SIZE
+
+            logging.info('Going through resumption. Last date %r', self.last_date)
+            self.params = {'resumptionToken': token}
+
+            sleep(self.DELAY)
+
+    def request_page(self):
+        """
+        Request a page with the current parameters.
+
+        Return None if the request failed. The delay before the next attempt
+        is already done in this case, including the one asked with Retry-After.
+        """
         try:
-            response = get(self.URL, self.params, verify=True)
+            response = get(self.URL, self.params, verify=True, stream=self.stream)
         except (urllib3.exceptions.MaxRetryError,
                 urllib3.exceptions.NewConnectionError,
                 urllib3.exceptions.HTTPError,
@@ -84,10 +151,8 @@ class ArxivOaiApi:
             logging.warning('urllib3 exception: %r', exep)
             sleep(self.DELAY)
             self.fail_attempts += 1
-            yield from self.download_papers(rest=rest)
+            return None
 
-        if response is None:
-            return
         try:
             response.raise_for_status()
         except exceptions.HTTPError:
@@ -99,72 +164,146 @@ class ArxivOaiApi:
                 sleep(delay)
             sleep(self.DELAY)
             self.fail_attempts += 1
-            yield from self.download_papers(rest=rest)
+            return None
+
+        return response
+
+    def fetch_pages(self) -> Generator[bytes, None, None]:
+        """
+        Generator of the raw pages for the pipelined harvest.
+
+        Only the resumption token is looked up in the page,
+        the records are left for parse_content().
+        """
+        while True:
+            if self.fail_attempts > self.MAX_FAIL:
+                logging.error('arXiv exceeds max allowed error limit')
+                return
 
-        if self.fail_attempts > self.MAX_FAIL:
-            return
+            response = self.request_page()
+            if response is None:
+                continue
 
-        logging.info('Ask arxiv with %r', response.url)
+            logging.info('Ask arxiv with %r', response.url)
+            yield response.content
 
+            token = self.TOKEN.search(response.content)
+            if token is None or not token.group(1):
+                return
+
+            self.params = {'resumptionToken': unescape(token.group(1).decode())}
+            sleep(self.DELAY)
+
+    def parse_content(self, content: bytes) -> List[Paper]:
+        """Parse the raw page into papers."""
+        lor = ET.fromstring(content).find(self.OAI + 'ListRecords')
+        if not lor:
+            logging.error('Empty response from arXiv')
+            return []
+        return [self.parse_record(record) for record in lor.findall(self.OAI + 'record')]
+
+    def read_page(self, response) -> Generator[Paper, None, Tuple[int, Optional[str], int]]:
+        """
+        Parse the whole page at once.
+
+        Return the number of records, resumption token and the complete list size.
+        """
         lor = ET.fromstring(response.text).find(self.OAI + 'ListRecords')
         if not lor:
             logging.error('Empty response from arXiv')
-            return
+            return 0, None, 0
         records = lor.findall(self.OAI + 'record')
 
-        if len(records) != self.BATCH_SIZE and len(records) != rest:
-            logging.warning('Download incomplete. Got %i from %i or %i',
-                            len(records),
-                            self.BATCH_SIZE,
-                            rest
-                            )
-
-        updated = 'null'
         for record in records:
-            info = record.find(self.OAI + 'metadata').find(self.ARXIV + 'arXivRaw')
-
-            # WARNING is 'v?' tag always ordered?
-            # assume yes, but who knows...
-            versions = info.findall(self.ARXIV + 'version')
-            created = versions[0].find(self.ARXIV + 'date').text
-            created = created.split(', ')[1]
-            created = datetime.strptime(created, "%d %b %Y %H:%M:%S GMT")
-
-            updated = versions[-1].find(self.ARXIV + 'date').text
-            updated = updated.split(', ')[1]
-            updated = datetime.strptime(updated, "%d %b %Y %H:%M:%S GMT")
-
-            # use only first doi
-            doi = info.find(self.ARXIV + "doi")
-            if doi is not None:
-                doi = doi.text.split()[0]
-
-            paper = Paper(paper_id=info.find(self.ARXIV + 'id').text,
-                          title=fix_xml(info.find(self.ARXIV + 'title').text),
-                          author=parse_authors(info.find(self.ARXIV + 'authors').text),
-                          date_up=updated,
-                          date_sub=created,
-                          version=versions[-1].get('version'),
-                          doi=doi,
-                          abstract=fix_xml(info.find(self.ARXIV + 'abstract').text),
-                          cats=info.find(self.ARXIV + 'categories').text.split(' '),
-                          source=1
-                          )
-
-            yield paper
-
-        # check if the next call is required
-        token = lor.find(self.OAI + 'resumptionToken')
-        if token is None or token.text is None:
-            return
-
-        rest = int(token.get('completeListSize')) % self.BATCH_SIZE
+            yield self.parse_record(record)
+
+        token, list_size = self.parse_token(lor.find(self.OAI + 'resumptionToken'))
+        return len(records), token, list_size
+
+    def stream_page(self,
+                    response,
+                    skip: int = 0
+                    ) -> Generator[Paper, None, Tuple[int, Optional[str], int]]:
+        """
+        Parse the page incrementally while it is downloaded.
+
+        Every paper is yielded as soon as its record is closed,
+        the first skip records are already yielded by the broken attempt.
+        The parsed records are dropped to keep the memory low.
+        The broken download raises PageInterrupted, the response is closed in any case.
+        Return the number of records, resumption token and the complete list size.
+        """
+        response.raw.decode_content = True
+        n_records = 0
+        token, list_size = None, 0
+        lor = None
+        try:
+            for event, elem in ET.iterparse(response.raw, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == self.OAI + 'ListRecords':
+                        lor = elem
+                    continue
+
+                if elem.tag == self.OAI + 'record':
+                    n_records += 1
+                    if n_records > skip:
+                        yield self.parse_record(elem)
+                    elem.clear()
+                    if lor is not None:
+                        lor.remove(elem)
+                elif elem.tag == self.OAI + 'resumptionToken':
+                    token, list_size = self.parse_token(elem)
+        except (exceptions.RequestException,
+                urllib3.exceptions.HTTPError,
+                ET.ParseError
+                ) as exep:
+            raise PageInterrupted(n_records) from exep
+        finally:
+            response.close()
 
-        logging.info('Going through resumption. Last date %r', updated)
-        self.params = {'resumptionToken': token.text}
+        if lor is None:
+            logging.error('Empty response from arXiv')
+        return n_records, token, list_size
 
-        sleep(self.DELAY)
-        yield from self.download_papers(rest=rest)
+    @staticmethod
+    def parse_token(token) -> Tuple[Optional[str], int]:
+        """Resumption token and the complete list size."""
+        if token is None or token.text is None:
+            return None, 0
+        return token.text, int(token.get('completeListSize'))
+
+    def parse_record(self, record) -> Paper:
+        """Create a paper from the OAI record."""
+        info = record.find(self.OAI + 'metadata').find(self.ARXIV + 'arXivRaw')
+
+        # WARNING is 'v?' tag always ordered?
+        # assume yes, but who knows...
+        versions = info.findall(self.ARXIV + 'version')
+        created = versions[0].find(self.ARXIV + 'date').text
+        created = created.split(', ')[1]
+        created = datetime.strptime(created, "%d %b %Y %H:%M:%S GMT")
+
+        updated = versions[-1].find(self.ARXIV + 'date').text
+        updated = updated.split(', ')[1]
+        updated = datetime.strptime(updated, "%d %b %Y %H:%M:%S GMT")
+        self.last_date = updated
+
+        # use only first doi
+        doi = info.find(self.ARXIV + "doi")
+        if doi is not None:
+            doi = doi.text.split()[0]
+
+        return Paper(paper_id=info.find(self.ARXIV + 'id').text,
+                     title=fix_xml(info.find(self.ARXIV + 'title').text),
+                     author=parse_authors(info.find(self.ARXIV + 'authors').text),
+                     date_up=updated,
+                     date_sub=created,
+                     version=versions[-1].get('version'),
+                     doi=doi,
+                     abstract=fix_xml(info.find(self.ARXIV + 'abstract').text),
+                     cats=info.find(self.ARXIV + 'categories').text.split(' '),
+                     source=1
+                     )
 
 
 def parse_authors(author_xml: str) -> List[str]:
@@ -3,14 +3,40 @@ Interface for the paper table in the DB.
 
 Paper downloader function update the paper DB
 Query request to the DB.
+
+One time maintenance of the paper table with the flask CLI
+flask papers prepare       -- create the DB extensions, run before "flask db upgrade"
+flask papers fill-authors  -- fill the author search text of the old papers
 """
 
 import logging
 from datetime import datetime
-from typing import List
+from queue import Queue, Full, Empty
+from threading import Thread, Event
+from time import perf_counter
+from typing import List, Dict, Tuple, Optional
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, literal_column, any_, select, tuple_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .interfaces.model import db, Paper, PaperCacheDay, PaperCacheWeeks, PaperList, \
+    paper_associate, PAPER_PARTITIONS
+from .utils_app import get_old_update_date, job_progress
 
-from .interfaces.model import db, Paper, PaperCacheDay, PaperCacheWeeks
-from .utils_app import get_old_update_date
+papers_cli = AppGroup('papers', help='Maintain the paper table.')
+
+# number of pages waiting between the pipeline stages
+PIPELINE_QUEUE = 2
+# seconds to wait for the queue before checking the pipeline stop
+PIPELINE_TIMEOUT = 1
+# bookmarks inserted in one statement, see add_list_papers()
+BOOKMARK_BATCH = 1000
+
+# fields refreshed for the existing paper, see update_paper_record()
+UPDATE_FIELDS = ('title', 'date_up', 'author', 'author_text', 'doi', 'version', 'abstract', 'cats')
+INSERT_FIELDS = ('paper_id', 'date_sub', 'source') + UPDATE_FIELDS
 
 
 def update_papers(api_list: List, **kwargs):
@@ -19,49 +45,384 @@ def update_papers(api_list: List, **kwargs):
 
     Get papers from all API with download_papers()
     and store in the DB.
+    With pipeline=True the API should provide fetch_pages() and parse_content()
+    With bulk=True the papers are stored with INSERT ... ON CONFLICT per COMMIT_PERIOD
     """
     for api in api_list:
-        update_paper_per_api(api, **kwargs)
+        if kwargs.get('pipeline'):
+            update_paper_per_api_pipeline(api, **kwargs)
+        elif kwargs.get('bulk'):
+            update_paper_per_api_bulk(api, **kwargs)
+        else:
+            update_paper_per_api(api, **kwargs)
 
     db.session.commit()
 
 
-def update_paper_per_api(api, **kwargs):
-    """Update papers for a given API."""
+def update_paper_per_api(api, **kwargs) -> Tuple[int, int]:
+    """
+    Update papers for a given API.
+
+    The papers are buffered per COMMIT_PERIOD and checked in the DB with one query per batch.
+    Return the number of new and updated papers.
+    """
     n_papers = kwargs.get('n_papers')
     last_paper_date = kwargs['last_paper_date']
 
     updated = 0
     downloaded = 0
+    batch = []
 
     for paper in api.download_papers():
+        # too old paper. Skip
+        if paper.date_up < last_paper_date:
+            continue
+
+        batch.append(paper)
+        # flush as soon as the batch can reach the limit
+        # so no extra page is downloaded
+        if len(batch) < api.COMMIT_PERIOD and \
+                not (n_papers and len(batch) > n_papers - updated - downloaded):
+            continue
+
+        new, upd = store_papers(batch,
+                                kwargs.get('do_update'),
+                                limit_left(n_papers, downloaded + updated)
+                                )
+        downloaded += new
+        updated += upd
+        batch = []
+        logging.info('read %i papers', updated + downloaded)
+        job_progress(new=downloaded, updated=updated)
+        db.session.commit()
+
         # stoppers
         if n_papers and updated + downloaded > n_papers:
             break
 
+    new, upd = store_papers(batch,
+                            kwargs.get('do_update'),
+                            limit_left(n_papers, downloaded + updated)
+                            )
+    downloaded += new
+    updated += upd
+
+    logging.info('Paper update %s done: %i new; %i updated',
+                 api.__class__.__name__,
+                 downloaded,
+                 updated
+                 )
+    job_progress(new=downloaded, updated=updated)
+    return downloaded, updated
+
+
+def update_paper_per_api_bulk(api, **kwargs) -> Tuple[int, int]:
+    """
+    Update papers for a given API with the bulk upsert.
+
+    The papers are collected in batches of COMMIT_PERIOD
+    and every batch is written with a single statement.
+    Return the number of new and updated papers.
+    """
+    n_papers = kwargs.get('n_papers')
+    last_paper_date = kwargs['last_paper_date']
+
+    updated = 0
+    downloaded = 0
+    harvested = 0
+    batch = []
+
+    for paper in api.download_papers():
+        # stoppers
+        # the stored papers are known only after the batch is written
+        # so the limit is applied to the harvested papers
+        if n_papers and harvested > n_papers:
+            break
+
         # too old paper. Skip
         if paper.date_up < last_paper_date:
             continue
 
-        paper_prev = Paper.query.filter_by(paper_id=paper.paper_id).first()
+        batch.append(paper)
+        harvested += 1
 
-        if paper_prev:
-            if kwargs.get('do_update'):
-                update_paper_record(paper_prev, paper)
-                updated += 1
-        else:
-            db.session.add(paper)
-            downloaded += 1
-
-        if (updated + downloaded) % api.COMMIT_PERIOD == 0:
+        if len(batch) == api.COMMIT_PERIOD:
+            new, upd = upsert_papers(batch, kwargs.get('do_update'))
+            downloaded += new
+            updated += upd
+            batch = []
             logging.info('read %i papers', updated + downloaded)
+            job_progress(new=downloaded, updated=updated)
             db.session.commit()
 
+    new, upd = upsert_papers(batch, kwargs.get('do_update'))
+    downloaded += new
+    updated += upd
+    db.session.commit()
+
     logging.info('Paper update %s done: %i new; %i updated',
                  api.__class__.__name__,
                  downloaded,
                  updated
                  )
+    job_progress(new=downloaded, updated=updated)
+    return downloaded, updated
+
+
+def update_paper_per_api_pipeline(api, **kwargs) -> Dict:
+    """
+    Update papers for a given API with the pipelined harvest.
+
+    Three stages work in parallel and pass the data through bounded queues:
+    1. fetch the raw pages with the API delays
+    2. parse the pages into papers
+    3. store the papers in the DB (the calling thread with the app context)
+
+    The errors of the fetch and parse stages are raised in the calling thread.
+    Return the time spent in each stage.
+    """
+    timing = {'fetch': 0., 'parse': 0., 'store': 0.}
+    pages = Queue(maxsize=PIPELINE_QUEUE)
+    batches = Queue(maxsize=PIPELINE_QUEUE)
+    stop = Event()
+    errors = []
+
+    threads = [Thread(target=pipeline_fetch,
+                      args=(api, pages, stop, timing, errors),
+                      daemon=True
+                      ),
+               Thread(target=pipeline_parse,
+                      args=(api, (pages, batches), stop, timing, errors),
+                      kwargs=kwargs,
+                      daemon=True
+                      )
+               ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        downloaded, updated = pipeline_store(batches, stop, timing, **kwargs)
+    finally:
+        # release the stages waiting for the queue
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    # the stored papers are committed, but the harvest is not complete
+    if errors:
+        raise errors[0]
+
+    logging.info('Paper update %s done: %i new; %i updated',
+                 api.__class__.__name__,
+                 downloaded,
+                 updated
+                 )
+    job_progress(new=downloaded, updated=updated)
+    logging.info('Pipeline timing: fetch %.1fs parse %.1fs store %.1fs',
+                 timing['fetch'],
+                 timing['parse'],
+                 timing['store']
+                 )
+    return timing
+
+
+def pipeline_fetch(api, pages: Queue, stop: Event, timing: Dict, errors: List):
+    """Fetch stage of the pipelined harvest, put the raw pages into the queue."""
+    try:
+        start = perf_counter()
+        for content in api.fetch_pages():
+            timing['fetch'] += perf_counter() - start
+            if not put_or_stop(pages, content, stop):
+                break
+            start = perf_counter()
+    except Exception as err:  # pylint: disable=broad-except
+        logging.exception('Pipeline fetch failed')
+        errors.append(err)
+    finally:
+        put_or_stop(pages, None, stop)
+
+
+def pipeline_parse(api,
+                   queues: Tuple[Queue, Queue],
+                   stop: Event,
+                   timing: Dict,
+                   errors: List,
+                   **kwargs
+                   ):
+    """Parse stage of the pipelined harvest, turn the pages into the paper batches."""
+    pages, batches = queues
+    last_paper_date = kwargs['last_paper_date']
+    try:
+        while True:
+            content = get_or_stop(pages, stop)
+            if content is None:
+                break
+            start = perf_counter()
+            batch = [paper for paper in api.parse_content(content)
+                     # too old paper. Skip
+                     if paper.date_up >= last_paper_date
+                     ]
+            timing['parse'] += perf_counter() - start
+            if not put_or_stop(batches, batch, stop):
+                break
+    except Exception as err:  # pylint: disable=broad-except
+        logging.exception('Pipeline parse failed')
+        errors.append(err)
+    finally:
+        put_or_stop(batches, None, stop)
+
+
+def pipeline_store(batches: Queue, stop: Event, timing: Dict, **kwargs) -> Tuple[int, int]:
+    """
+    Store stage of the pipelined harvest, commit the paper batches.
+
+    Set the stop when more than n_papers are stored.
+    Return the number of new and updated papers.
+    """
+    n_papers = kwargs.get('n_papers')
+    updated = 0
+    downloaded = 0
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        start = perf_counter()
+        if kwargs.get('bulk'):
+            new, upd = upsert_papers(batch, kwargs.get('do_update'))
+        else:
+            new, upd = store_papers(batch,
+                                    kwargs.get('do_update'),
+                                    limit_left(n_papers, downloaded + updated)
+                                    )
+        downloaded += new
+        updated += upd
+        # stoppers
+        if n_papers and updated + downloaded > n_papers:
+            stop.set()
+
+        db.session.commit()
+        timing['store'] += perf_counter() - start
+        logging.info('read %i papers', updated + downloaded)
+        job_progress(new=downloaded, updated=updated)
+        if stop.is_set():
+            break
+
+    return downloaded, updated
+
+
+def put_or_stop(queue: Queue, item, stop: Event) -> bool:
+    """Put the item into the bounded queue unless the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=PIPELINE_TIMEOUT)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def get_or_stop(queue: Queue, stop: Event):
+    """Get the item from the bounded queue, None if the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=PIPELINE_TIMEOUT)
+        except Empty:
+            continue
+    return None
+
+
+def store_papers(papers: List[Paper],
+                 do_update: bool,
+                 limit: Optional[int] = None
+                 ) -> Tuple[int, int]:
+    """
+    Add the new papers and update the existing ones.
+
+    The existing papers are looked up with a single query for the whole batch.
+    The processing stops when more than limit papers are stored.
+    Return the number of new and updated papers.
+    """
+    if not papers:
+        return 0, 0
+
+    ids = sorted({paper.paper_id for paper in papers})
+    if PAPER_PARTITIONS:
+        lock_paper_ids(ids)
+    existing = {paper.paper_id: paper
+                for paper in Paper.query.filter(Paper.paper_id == any_(ids))
+                }
+
+    updated = 0
+    downloaded = 0
+    for paper in papers:
+        # stoppers
+        if limit is not None and updated + downloaded > limit:
+            break
+
+        paper_prev = existing.get(paper.paper_id)
+
+        if paper_prev:
+            if do_update:
+                update_paper_record(paper_prev, paper)
+                updated += 1
+        else:
+            db.session.add(paper)
+            # the same paper can come twice in a batch
+            existing[paper.paper_id] = paper
+            downloaded += 1
+
+    return downloaded, updated
+
+
+def lock_paper_ids(ids: List[str]):
+    """
+    Lock the paper ids till the end of the transaction.
+
+    The partitioned table has no unique paper id without the date,
+    so the concurrent harvests wait for each other before the lookup of the existing papers.
+    The ids are locked in the sorted order to avoid the deadlocks.
+    """
+    db.session.execute(text('SELECT pg_advisory_xact_lock(hashtext(paper_id)) '
+                            'FROM unnest(CAST(:ids AS text[])) '
+                            'WITH ORDINALITY AS ids(paper_id, num) '
+                            'ORDER BY num'
+                            ),
+                       {'ids': ids}
+                       )
+
+
+def limit_left(n_papers: Optional[int], stored: int) -> Optional[int]:
+    """Number of papers that can be stored before the n_papers limit."""
+    return n_papers - stored if n_papers else None
+
+
+def upsert_papers(papers: List[Paper], do_update: bool) -> Tuple[int, int]:
+    """
+    Store the papers with a single INSERT ... ON CONFLICT (paper_id) statement.
+
+    Without do_update the existing papers are left untouched.
+    Return the number of new and updated papers.
+    """
+    if not papers:
+        return 0, 0
+
+    # one statement can't affect the same row twice, keep the latest record
+    rows = {paper.paper_id: {field: getattr(paper, field) for field in INSERT_FIELDS}
+            for paper in papers
+            }
+    stmt = pg_insert(Paper).values(list(rows.values()))
+    if do_update:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Paper.paper_id],
+            set_={field: stmt.excluded[field] for field in UPDATE_FIELDS}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[Paper.paper_id])
+
+    # xmax is zero only for the freshly inserted rows
+    inserted = [row[0] for row in db.session.execute(stmt.returning(literal_column('xmax = 0')))]
+    new = sum(inserted)
+    return new, len(inserted) - new
 
 
 def update_paper_record(paper_prev: Paper, paper: Paper):
@@ -75,17 +436,117 @@ def update_paper_record(paper_prev: Paper, paper: Paper):
     paper_prev.cats = paper.cats
 
 
+def create_extensions():
+    """
+    Create the extensions required by the paper indices.
+
+    pg_trgm provides the trigram operators of the text indices.
+    The auto-generated migrations don't create the extensions.
+    """
+    db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    db.session.commit()
+
+
+def fill_author_text() -> int:
+    """
+    Fill the author search text for papers stored before the column was introduced.
+
+    The new papers get the text with the author list, so it's done once after the migration.
+    """
+    n_filled = Paper.query.filter(Paper.author_text.is_(None)).update(
+        {Paper.author_text: func.lower(func.array_to_string(Paper.author, ', '))},
+        synchronize_session=False
+    )
+    db.session.commit()
+    if n_filled:
+        logging.info('Author search text filled for %i papers', n_filled)
+    return n_filled
+
+
+def refresh_paper_cache(cache, window_start: datetime) -> Dict[str, int]:
+    """
+    Refresh the paper cache table incrementally.
+
+    The papers that left the window or the paper table are evicted,
+    the new and changed papers are upserted, the unchanged rows are not touched.
+    No commit is done so the caller keeps the refresh in one transaction.
+    Return the number of inserted, updated and evicted rows.
+    """
+    source = Paper.__table__
+    table = cache.__table__
+    keys = [column.key for column in table.columns if column.computed is None]
+    # the core statements below don't flush the session
+    db.session.flush()
+
+    evicted = db.session.execute(table.delete().where(
+        ~select(source.c.id).where(source.c.paper_id == table.c.paper_id,
+                                   source.c.date_up > window_start
+                                   ).exists()
+    )).rowcount
+
+    stmt = pg_insert(table).from_select(
+        keys,
+        select(*[source.c[key] for key in keys]).where(source.c.date_up > window_start)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.paper_id],
+        set_={key: stmt.excluded[key] for key in keys if key != 'paper_id'},
+        where=tuple_(*[table.c[key] for key in keys]).is_distinct_from(
+            tuple_(*[stmt.excluded[key] for key in keys])
+        )
+    )
+    # xmax is zero only for the freshly inserted rows
+    inserted = [row[0] for row in db.session.execute(stmt.returning(literal_column('xmax = 0')))]
+    stat = {'inserted': sum(inserted),
+            'updated': len(inserted) - sum(inserted),
+            'evicted': evicted
+            }
+    logging.info('Cache %s refreshed: %r', table.name, stat)
+    return stat
+
+
+def paper_columns(source, with_abstract: bool = True) -> List:
+    """
+    Columns of the paper projection.
+
+    The abstract is the largest field, so it could be skipped.
+    """
+    columns = [source.id,
+               source.paper_id,
+               source.title,
+               source.author,
+               source.date_up,
+               source.date_sub,
+               source.version,
+               source.doi,
+               source.cats,
+               source.source
+               ]
+    if with_abstract:
+        columns.append(source.abstract)
+    return columns
+
+
+def paper_source(old_date: datetime):
+    """Choose the paper table or the cache for the date range."""
+    old_date_record = get_old_update_date()
+    # the partitioned table is pruned to the requested dates, no cache is needed
+    use_cache = not PAPER_PARTITIONS
+    if use_cache and old_date_record.first_paper_day_cache and \
+            old_date >= old_date_record.first_paper_day_cache:
+        return PaperCacheDay
+    if use_cache and old_date_record.first_paper_weeks_cache and \
+            old_date >= old_date_record.first_paper_weeks_cache:
+        return PaperCacheWeeks
+    return Paper
+
+
 def get_papers_from_db(cats: list,
                        old_date: datetime,
                        new_date: datetime
                        ) -> List[Paper]:
     """Make the DB request."""
-    source = Paper
-    old_date_record = get_old_update_date()
-    if old_date_record.first_paper_day_cache and old_date >= old_date_record.first_paper_day_cache:
-        source = PaperCacheDay
-    elif old_date_record.first_paper_weeks_cache and old_date >= old_date_record.first_paper_weeks_cache:
-        source = PaperCacheWeeks
+    source = paper_source(old_date)
     paper_query = source.query.filter(
         source.cats.overlap(cats),
         source.date_up > old_date,
@@ -93,3 +554,127 @@ def get_papers_from_db(cats: list,
     ).order_by(source.date_up.desc()).all()
 
     return paper_query
+
+
+def get_paper_rows_from_db(cats: list,
+                           old_date: datetime,
+                           new_date: datetime,
+                           with_abstract: bool = True,
+                           with_start: bool = False
+                           ) -> List:
+    """
+    Make the DB request for the paper columns only, rows are plain tuples.
+
+    The range excludes the dates, with_start includes old_date.
+    """
+    source = paper_source(old_date)
+    return db.session.query(*paper_columns(source, with_abstract)).filter(
+        source.cats.overlap(cats),
+        source.date_up >= old_date if with_start else source.date_up > old_date,
+        source.date_up < new_date,
+    ).order_by(source.date_up.desc()).all()
+
+
+def get_paper_page_from_db(cats: list,
+                           old_date: datetime,
+                           new_date: datetime,
+                           after: Tuple[datetime, int],
+                           limit: int
+                           ) -> List:
+    """Paper columns of the page after the (date_up, id) cursor in the descending order."""
+    source = paper_source(old_date)
+    return db.session.query(*paper_columns(source)).filter(
+        source.cats.overlap(cats),
+        source.date_up > old_date,
+        source.date_up < new_date,
+        tuple_(source.date_up, source.id) < tuple_(*after)
+    ).order_by(source.date_up.desc(), source.id.desc()).limit(limit).all()
+
+
+def count_list_papers(list_id: int) -> int:
+    """Number of papers in the paper list."""
+    return db.session.query(func.count()).select_from(paper_associate).filter(
+        paper_associate.columns.list_ref_id == list_id
+    ).scalar()
+
+
+def get_list_page_from_db(list_id: int,
+                          order: str,
+                          reverse: bool,
+                          offset: int,
+                          limit: int
+                          ) -> List:
+    """
+    Page of the paper list sorted in the DB.
+
+    order is 'date-up' or 'date-sub', reverse means the descending order.
+    """
+    column = Paper.date_sub if order == 'date-sub' else Paper.date_up
+    # id makes the order stable between the pages
+    order_by = [column.desc(), Paper.id.desc()] if reverse else [column.asc(), Paper.id.asc()]
+    return db.session.query(*paper_columns(Paper)).join(
+        paper_associate,
+        paper_associate.columns.paper_ref_id == Paper.id
+    ).filter(paper_associate.columns.list_ref_id == list_id
+             ).order_by(*order_by).offset(offset).limit(limit).all()
+
+
+def get_abstracts(ids: List[int]) -> Dict[int, str]:
+    """Abstracts of the papers by the DB id."""
+    return dict(db.session.query(Paper.id, Paper.abstract).filter(Paper.id == any_(ids)).all())
+
+
+def add_list_papers(pairs: List[Tuple[int, int]]) -> Dict[int, int]:
+    """
+    Add the papers to the lists in bulk, the papers already in a list are skipped.
+
+    pairs are (list id, paper id) inserted in batches of BOOKMARK_BATCH.
+    The not_seen counter of each list is increased by the number of the added papers.
+    No commit is done.
+    Return the number of the added papers per list.
+    """
+    added = {}
+    pairs = list(dict.fromkeys(pairs))
+    for start in range(0, len(pairs), BOOKMARK_BATCH):
+        rows = db.session.execute(pg_insert(paper_associate).values(
+            [{'list_ref_id': list_id, 'paper_ref_id': paper_id}
+             for list_id, paper_id in pairs[start:start + BOOKMARK_BATCH]]
+        ).on_conflict_do_nothing().returning(paper_associate.columns.list_ref_id))
+        for (list_id,) in rows:
+            added[list_id] = added.get(list_id, 0) + 1
+
+    lists = PaperList.__table__
+    for list_id, n_papers in added.items():
+        db.session.execute(lists.update().where(lists.columns.id == list_id).values(
+            not_seen=func.coalesce(lists.columns.not_seen, 0) + n_papers
+        ))
+    return added
+
+
+def get_new_papers(cats: List[str],
+                   old_date: datetime,
+                   rule_filter=None,
+                   until: Optional[datetime] = None
+                   ) -> List[Paper]:
+    """Papers of any of the categories updated after the date and until the bound, by date_up."""
+    paper_query = Paper.query.filter(Paper.cats.overlap(cats),
+                                     Paper.date_up > old_date
+                                     )
+    if until is not None:
+        paper_query = paper_query.filter(Paper.date_up <= until)
+    if rule_filter is not None:
+        paper_query = paper_query.filter(rule_filter)
+    return paper_query.order_by(Paper.date_up).all()
+
+
+@papers_cli.command('prepare')
+def prepare_command():
+    """Create the DB extensions before the migration."""
+    create_extensions()
+    click.echo('DB extensions are created')
+
+
+@papers_cli.command('fill-authors')
+def fill_authors_command():
+    """Fill the author search text of the papers stored before the column was introduced."""
+    click.echo(f'Author search text filled for {fill_author_text()} papers')
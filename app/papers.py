@@ -5,76 +5,22 @@ Tag processor checks if a given paper is suitable with the tag
 """
 
 import logging
-from datetime import datetime, timedelta
-from re import search, compile, IGNORECASE, error
-from typing import List, Tuple
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import partial
+from re import search, compile, IGNORECASE, error, Pattern
+from sys import getsizeof
+from threading import Lock
+from time import perf_counter
+from typing import List, Tuple, Optional, Dict, Callable
 
 from sentry_sdk import start_transaction
+from sqlalchemy import or_, and_, not_, false, func
 
 from .interfaces.data_structures import PaperInterface, PaperResponse, TagInterface
-from .paper_api import get_date_range, get_arxiv_sub_start
-from .paper_db import get_papers_from_db
-
-
-def process_nov(paper: PaperInterface, nov_counters: list, cats: list, last_date: datetime):
-    """Check novelty of the papers. Update counters."""
-    # 1.a check if cross-ref
-    if paper.cats[0] not in cats:
-        nov_counters[1] += 1
-        paper.nov += 2
-
-    # 1.b count updated papers
-    if paper.date_sub < last_date:
-        paper.nov += 4
-        nov_counters[2] += 1
-
-    if paper.nov == 0:
-        paper.nov = 1
-        nov_counters[0] += 1
-
-
-def process_tags(paper: PaperInterface,
-                 tags: List[TagInterface],
-                 tag_counter):
-    """Apply tags for a given paper and increment a counter."""
-    for num, tag in enumerate(tags):
-        if tag_suitable(paper, tag.rule):
-            paper.tags.append(num)
-            tag_counter[num] += 1
-
-
-def process_papers(response: PaperResponse,
-                   tags: List[TagInterface],
-                   cats: List,
-                   do_nov: bool,
-                   do_tag: bool
-                   ) -> None:
-    """
-    Response processing. Count papers per category, per novelty, per tag.
-
-    Process:
-    1. novelty. use 'bit' map
-        0 - undef 1 - new, 2 - cross, 4 - up
-        a. cross-ref
-        b. updated
-    2. categories
-    3. process tags
-    """
-    response.nnov = [0] * 3
-    response.ncat = [0] * len(cats)
-    response.ntag = [0] * len(tags)
-    with start_transaction(op="paper_processing", name='papers'):
-        for paper in response.papers:
-            if do_nov:
-                # count paper per category
-                for cat in paper.cats:
-                    if cat in cats:
-                        response.ncat[cats.index(cat)] += 1
-                process_nov(paper, response.nnov, cats, response.last_date)
-
-            # 2.
-            if do_tag:
-                process_tags(paper, tags, response.ntag)
+from .paper_api import get_date_range, get_arxiv_sub_start, get_arxiv_sub_end
+from .paper_db import get_paper_rows_from_db, get_abstracts, get_new_papers
+from .utils_app import get_old_update_date
 
 
 def find_or_and(rule: str) -> Tuple[List[int], List[int]]:
@@ -97,88 +43,405 @@ def find_or_and(rule: str) -> Tuple[List[int], List[int]]:
     return or_pos, and_pos
 
 
-def tag_suitable(paper: PaperInterface, rule: str) -> bool:
+class PaperCorpus:
+    """Search targets of a paper list. Each field is built once for the whole list."""
+    def __init__(self, papers: List[PaperInterface]):
+        self.papers = papers
+        self._fields = {}
+
+    def __len__(self) -> int:
+        return len(self.papers)
+
+    def field(self, prefix: str) -> List[str]:
+        """Search targets for the given prefix, e.g. ti or au."""
+        if prefix not in self._fields:
+            self._fields[prefix] = [paper[prefix] for paper in self.papers]
+        return self._fields[prefix]
+
+
+class CategoryIndex:
     """
-    Checking rule for the given paper.
+    New papers shared by the users of a notification job.
 
-    The function is called recursively for checking different parts of the rule.
-    1. Find logic AND / OR outside curly and round brackets
-    2. If no - parse rules inside curly brackets
-    3. OR: and process rule parts one by one separated by |
-    return True at first true condition
-    return False if no matches
-    4. AND: process rule parts separated by &
-    return False at first false match
-    return True if no false matches
+    The papers are fetched once and indexed by category.
+    The users with the same categories share the paper list and the corpus.
+    """
+    def __init__(self, papers: List, load_time: float = 0.):
+        self.papers = papers
+        self.load_time = load_time
+        self._interfaces = [PaperInterface.from_paper(paper) for paper in papers]
+        self._by_cat = {}
+        for number, paper in enumerate(papers):
+            for cat in paper.cats or []:
+                self._by_cat.setdefault(cat, []).append(number)
+        self._groups = {}
+        self.requests = 0
+        self.served = 0
+
+    @classmethod
+    def load(cls,
+             cats: List[str],
+             old_date: datetime,
+             rule_filter=None,
+             until: Optional[datetime] = None
+             ) -> 'CategoryIndex':
+        """Fetch the papers of any of the categories updated after the date and until the bound."""
+        start = perf_counter()
+        index = cls(get_new_papers(list(cats), old_date, rule_filter, until))
+        index.load_time = perf_counter() - start
+        return index
+
+    def get(self, cats: List[str]) -> Tuple[List, PaperCorpus]:
+        """Papers of any of the categories sorted by date_up and their corpus."""
+        key = frozenset(cats or [])
+        if key not in self._groups:
+            numbers = sorted({number for cat in key for number in self._by_cat.get(cat, [])})
+            self._groups[key] = ([self.papers[number] for number in numbers],
+                                 PaperCorpus([self._interfaces[number] for number in numbers])
+                                 )
+        self.requests += 1
+        self.served += len(self._groups[key][0])
+        return self._groups[key]
+
+    def info(self) -> Dict:
+        """
+        Index statistics.
+
+        A query per request is replaced with one query,
+        the saved time is estimated from the load time per paper.
+        """
+        per_paper = self.load_time / len(self.papers) if self.papers else 0.
+        return {'papers': len(self.papers),
+                'requests': self.requests,
+                'groups': len(self._groups),
+                'queries_saved': max(self.requests - 1, 0),
+                'seconds_saved': max(per_paper * self.served - self.load_time, 0.)
+                }
+
+
+class SimpleRule:
+    """Leaf of the compiled rule: a single ti/au/abs/cat condition."""
+    # conditions that have the same meaning for Python and PostgreSQL regex
+    SQL_SAFE = compile(r"^[\w\s\-',.:|&!]*$")
+
+    def __init__(self, prefix: str, regex: Optional[Pattern], inversion: bool, source: str = ''):
+        self.prefix = prefix
+        self.regex = regex
+        self.inversion = inversion
+        # condition as written by the user
+        self.source = source
+
+    def evaluate(self, paper: PaperInterface) -> bool:
+        """Check the condition for the given paper."""
+        if self.regex is None:
+            return False
 
-    :param      paper:       The paper
-    :type       paper:       PaperInterface
-    :param      rule:        The rule
-    :type       rule:        str
+        search_target = paper[self.prefix]
+        if not search_target:
+            logging.warning("Paper `%s` doesn't have data for prefix: %r",
+                            paper.title,
+                            self.prefix
+                            )
+        # in case of
+        # 1. author
+        # 2. Paper category
+        #  the target is a list
+        # join the list into string
+        if isinstance(search_target, list):
+            search_target = ', '.join(search_target)
+
+        found = self.regex.search(search_target) is not None
+
+        if found != self.inversion:
+            logging.debug('Simple rule OK for %r', search_target)
+            return True
+        return False
 
-    :returns:   if the paper suits the tag
-    :rtype:     bool
+    def evaluate_batch(self, corpus: PaperCorpus, mask: List[bool]) -> List[bool]:
+        """Check the condition for all the papers selected with the mask."""
+        if self.regex is None:
+            return [False] * len(corpus)
+
+        regex_search = self.regex.search
+        inversion = self.inversion
+        return [selected and (regex_search(target) is not None) != inversion
+                for target, selected in zip(corpus.field(self.prefix), mask)
+                ]
+
+    def leaves(self) -> List:
+        """Simple rules of the tree."""
+        return [self]
+
+    def to_sql(self, model):
+        """SQL condition for the paper table. None if it can't be translated."""
+        if self.regex is None:
+            return false()
+
+        if not self.SQL_SAFE.match(self.source):
+            return None
+
+        condition = self.column_to_sql(sql_column(model, self.prefix))
+        if self.prefix == 'au':
+            # the papers stored before the author text was introduced have NULL there,
+            # they are checked with the text built from the author list
+            authors = func.lower(func.array_to_string(model.author, ', '))
+            condition = or_(condition,
+                            and_(model.author_text.is_(None), self.column_to_sql(authors))
+                            )
+        return condition
+
+    def column_to_sql(self, column):
+        """SQL condition for the given column."""
+        # the same casting as for the regex: split with OR, then with AND
+        condition = or_(*[and_(*[column.op('~*')(term) for term in or_subpart.split('&')])
+                          for or_subpart in self.source.replace('!', '').split('|')
+                          ])
+        return not_(condition) if self.inversion else condition
+
+
+class OrRule:
+    """Logic OR between the compiled rule parts."""
+    def __init__(self, parts: List):
+        self.parts = parts
+
+    def evaluate(self, paper: PaperInterface) -> bool:
+        """True at the first true part."""
+        return any(part.evaluate(paper) for part in self.parts)
+
+    def evaluate_batch(self, corpus: PaperCorpus, mask: List[bool]) -> List[bool]:
+        """Next parts are checked only for the papers not matched yet."""
+        result = [False] * len(corpus)
+        remaining = mask
+        for part in self.parts:
+            found = part.evaluate_batch(corpus, remaining)
+            result = [res or fnd for res, fnd in zip(result, found)]
+            remaining = [rem and not fnd for rem, fnd in zip(remaining, found)]
+        return result
+
+    def to_sql(self, model):
+        """SQL condition. None if any part can't be translated."""
+        parts = [part.to_sql(model) for part in self.parts]
+        if any(part is None for part in parts):
+            return None
+        return or_(*parts)
+
+    def leaves(self) -> List:
+        """Simple rules of the tree."""
+        return [leaf for part in self.parts for leaf in part.leaves()]
+
+
+class AndRule:
+    """Logic AND between the compiled rule parts."""
+    def __init__(self, parts: List):
+        self.parts = parts
+
+    def evaluate(self, paper: PaperInterface) -> bool:
+        """False at the first false part."""
+        return all(part.evaluate(paper) for part in self.parts)
+
+    def evaluate_batch(self, corpus: PaperCorpus, mask: List[bool]) -> List[bool]:
+        """Next parts are checked only for the papers still matching."""
+        result = mask
+        for part in self.parts:
+            result = part.evaluate_batch(corpus, result)
+        return result
+
+    def to_sql(self, model):
+        """SQL condition. The parts that can't be translated are skipped."""
+        parts = [part.to_sql(model) for part in self.parts]
+        parts = [part for part in parts if part is not None]
+        if not parts:
+            return None
+        return and_(*parts)
+
+    def leaves(self) -> List:
+        """Simple rules of the tree."""
+        return [leaf for part in self.parts for leaf in part.leaves()]
+
+
+class CompiledRule:
+    """
+    Tag rule parsed once into a tree of OR/AND nodes and simple rules.
+
+    The tree does not depend on the paper, so the rule could be compiled
+    once and evaluated for any number of papers.
+    """
+    def __init__(self, rule: str):
+        self.rule = rule
+        self.root = build_rule_tree(rule)
+
+    def evaluate(self, paper: PaperInterface) -> bool:
+        """Check if the paper suits the rule."""
+        return self.root.evaluate(paper)
+
+    def evaluate_batch(self, corpus: PaperCorpus) -> List[bool]:
+        """Check the rule for all the papers in the corpus in a single pass."""
+        return self.root.evaluate_batch(corpus, [True] * len(corpus))
+
+    def to_sql(self, model):
+        """
+        SQL condition for the paper table, e.g. Paper.
+
+        The condition selects a superset of the suitable papers,
+        the parts that can't be translated are left for Python.
+        None if nothing could be filtered in the DB.
+        """
+        return self.root.to_sql(model)
+
+    def leaves(self) -> List[SimpleRule]:
+        """Simple rules of the tree."""
+        return self.root.leaves()
+
+
+class RuleCache:
+    """
+    Process-wide LRU cache of the compiled rules keyed by the rule text.
+
+    The same rules are shared between users (e.g. copied public tags)
+    and evaluated again and again by the requests and the autohooks.
+    """
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._rules = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, rule: str) -> CompiledRule:
+        """Get the compiled rule. Compile and store it if missing."""
+        with self._lock:
+            compiled = self._rules.get(rule)
+            if compiled is not None:
+                self._rules.move_to_end(rule)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        # compile outside the lock, the rule parsing is independent
+        compiled = CompiledRule(rule)
+        if self.maxsize <= 0:
+            return compiled
+
+        with self._lock:
+            self._rules[rule] = compiled
+            self._rules.move_to_end(rule)
+            while len(self._rules) > self.maxsize:
+                self._rules.popitem(last=False)
+        return compiled
+
+    def invalidate(self, rule: str) -> None:
+        """Drop the rule from the cache."""
+        with self._lock:
+            self._rules.pop(rule, None)
+
+    def clear(self) -> None:
+        """Drop all the rules and reset counters."""
+        with self._lock:
+            self._rules.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def resize(self, maxsize: int) -> None:
+        """Change the cache size limit."""
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._rules) > max(maxsize, 0):
+                self._rules.popitem(last=False)
+
+    def info(self) -> Dict:
+        """Cache statistics."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._rules),
+                    'maxsize': self.maxsize
+                    }
+
+
+rule_cache = RuleCache()
+
+
+def compile_rule(rule: str) -> CompiledRule:
+    """Get the compiled tag rule for the repeated evaluation."""
+    return rule_cache.get(rule)
+
+
+def evaluate_rule_batch(rule: str, papers: List[PaperInterface]) -> List[bool]:
+    """Check if the papers suit the rule. Return a flag per paper."""
+    return compile_rule(rule).evaluate_batch(PaperCorpus(papers))
+
+
+def rules_to_sql(rules: List[str], model):
+    """
+    SQL condition that selects papers suitable with any of the rules.
+
+    None if any of the rules can't be filtered in the DB.
+    """
+    parts = [compile_rule(rule).to_sql(model) for rule in rules]
+    if not parts or any(part is None for part in parts):
+        return None
+    return or_(*parts)
+
+
+def sql_column(model, prefix: str):
+    """Paper table column as the search target for the given prefix."""
+    # title, abstract and author text of the paper table are indexed with trigrams
+    # so the case-insensitive regex is looked up in the index
+    if prefix == 'ti':
+        return model.title
+    if prefix == 'abs':
+        return model.abstract
+    if prefix == 'au':
+        return model.author_text
+    return func.array_to_string(model.cats, ', ')
+
+
+def build_rule_tree(rule: str):
+    """
+    Parse the rule into a tree.
+
+    The function is called recursively for different parts of the rule.
+    1. Find logic AND / OR outside curly and round brackets
+    2. If no - parse rules inside curly brackets
+    3. OR: split the rule into parts separated by |
+    4. AND: split the rule into parts separated by &
     """
     logging.debug('Start tag parse with rule %r', rule)
     # remove parentheses if the whole rule is inside
-    if rule[0] == '(' and rule[-1] == ')':
+    if rule[:1] == '(' and rule[-1:] == ')':
         rule = rule[1:-1]
 
     or_pos, and_pos = find_or_and(rule)
 
     # if no AND/OR found outside brackets process a rule inside curly brackets
-    if len(and_pos) == 0 + len(or_pos) == 0:
-        return parse_simple_rule(paper, rule)
-
-    # add rule length limits
-    or_pos.insert(0, -1)
-    or_pos.append(len(rule))
+    if len(and_pos) == 0 and len(or_pos) == 0:
+        return compile_simple_rule(rule)
 
     # process logic OR
-    if len(or_pos) > 2:
-        for num, pos in enumerate(or_pos[:-1]):
-            if tag_suitable(paper, rule[pos + 1:or_pos[num + 1]]):
-                return True
-
-    # if logic OR was found but True was not returned before
-    if len(or_pos) > 2:
-        return False
-
-    # add rule length limits
-    and_pos.insert(0, -1)
-    and_pos.append(len(rule))
+    if len(or_pos) > 0:
+        or_pos = [-1] + or_pos + [len(rule)]
+        return OrRule([build_rule_tree(rule[pos + 1:or_pos[num + 1]])
+                       for num, pos in enumerate(or_pos[:-1])
+                       ])
 
     # process logic AND
-    for num, pos in enumerate(and_pos[:-1]):
-        if not tag_suitable(paper, rule[pos + 1:and_pos[num + 1]]):
-            return False
-
-    # if logic AND is inside the rule but False was not found
-    return True
+    and_pos = [-1] + and_pos + [len(rule)]
+    return AndRule([build_rule_tree(rule[pos + 1:and_pos[num + 1]])
+                    for num, pos in enumerate(and_pos[:-1])
+                    ])
 
 
-def parse_simple_rule(paper: PaperInterface, condition: str) -> bool:
-    """Parse simple rules as ti/au/abs."""
+def compile_simple_rule(condition: str) -> SimpleRule:
+    """Compile simple rules as ti/au/abs."""
     prefix_re = search(r'^(ti|abs|au|cat){(.*?)}', condition)
     if not prefix_re:
-        return False
+        return SimpleRule('', None, False)
 
     prefix = prefix_re.group(1)
     condition = prefix_re.group(2)
 
     logging.debug('Initial simple rule %r', condition)
 
-    search_target = paper[prefix]
-    if not search_target:
-        logging.warning("Paper `%s` doesn't have data for prefix: %r", paper.title, prefix)
-    # in case of
-    # 1. author
-    # 2. Paper category
-    #  the target is a list
-    # join the list into string
-    if isinstance(search_target, list):
-        search_target = ', '.join(search_target)
-
     # cast logic AND to proper REGEX
     if '&' in condition:
         # split the condition with logic OR to cast the parts individually
@@ -211,23 +474,362 @@ def parse_simple_rule(paper: PaperInterface, condition: str) -> bool:
                           )
     except error:
         logging.error('Error in RegExp: %r', condition)
-        return False
+        re_cond = None
+
+    return SimpleRule(prefix, re_cond, inversion, prefix_re.group(2))
+
+
+def process_nov(paper: PaperInterface, nov_counters: list, cats: list, last_date: datetime):
+    """Check novelty of the papers. Update counters."""
+    # 1.a check if cross-ref
+    if paper.cats[0] not in cats:
+        nov_counters[1] += 1
+        paper.nov += 2
+
+    # 1.b count updated papers
+    if paper.date_sub < last_date:
+        paper.nov += 4
+        nov_counters[2] += 1
+
+    if paper.nov == 0:
+        paper.nov = 1
+        nov_counters[0] += 1
 
-    found = re_cond.search(search_target) is not None
 
-    if found != inversion:
-        logging.debug('Simple rule OK for %r', search_target)
-        return True
-    return False
+def process_tags(papers: List[PaperInterface],
+                 rules: List[CompiledRule],
+                 tag_counter):
+    """Apply compiled tag rules rule by rule for all the papers and increment a counter."""
+    corpus = PaperCorpus(papers)
+    for num, rule in enumerate(rules):
+        for paper, found in zip(papers, rule.evaluate_batch(corpus)):
+            if found:
+                paper.tags.append(num)
+                tag_counter[num] += 1
+
+
+def process_papers(response: PaperResponse,
+                   tags: List[TagInterface],
+                   cats: List,
+                   do_nov: bool,
+                   do_tag: bool
+                   ) -> None:
+    """
+    Response processing. Count papers per category, per novelty, per tag.
+
+    Process:
+    1. novelty. use 'bit' map
+        0 - undef 1 - new, 2 - cross, 4 - up
+        a. cross-ref
+        b. updated
+    2. categories
+    3. process tags
+    """
+    response.nnov = [0] * 3
+    response.ncat = [0] * len(cats)
+    response.ntag = [0] * len(tags)
+    with start_transaction(op="paper_processing", name='papers'):
+        if do_nov:
+            for paper in response.papers:
+                # count paper per category
+                for cat in paper.cats:
+                    if cat in cats:
+                        response.ncat[cats.index(cat)] += 1
+                process_nov(paper, response.nnov, cats, response.last_date)
+
+        # 2. evaluate the tag rules for the whole paper list at once
+        if do_tag:
+            rules = [compile_rule(tag.rule) for tag in tags]
+            process_tags(response.papers, rules, response.ntag)
+
+
+def tag_suitable(paper: PaperInterface, rule: str) -> bool:
+    """
+    Checking rule for the given paper.
+
+    Shortcut for a single evaluation. Prefer compile_rule()
+    when the same rule is checked for many papers.
+
+    :param      paper:       The paper
+    :type       paper:       PaperInterface
+    :param      rule:        The rule
+    :type       rule:        str
+
+    :returns:   if the paper suits the tag
+    :rtype:     bool
+    """
+    return compile_rule(rule).evaluate(paper)
+
+
+def parse_simple_rule(paper: PaperInterface, condition: str) -> bool:
+    """Parse simple rules as ti/au/abs."""
+    return compile_simple_rule(condition).evaluate(paper)
+
+
+class ListingCache:
+    """
+    Process-wide LRU cache of the paper rows per (category, announcement day).
+
+    Every user opening the same day runs the same query for the overlapping categories.
+    The rows are immutable, the paper interfaces are built per request.
+    The harvest time is a part of the key, so the other workers
+    don't serve the stale listing after the harvest.
+    The size is limited both in number of slices and in bytes.
+    """
+    def __init__(self, maxsize: int = 256, maxbytes: int = 64 * 2 ** 20):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._rows = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Tuple, loader: Callable[[], List]) -> List:
+        """Get the rows. Load and store them if missing."""
+        with self._lock:
+            cached = self._rows.get(key)
+            if cached is not None:
+                self._rows.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        # load outside the lock, the DB request is the slow part
+        rows = loader()
+        size = rows_size(rows)
+        if self.maxsize <= 0 or size > self.maxbytes:
+            return rows
+
+        with self._lock:
+            previous = self._rows.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            self._rows[key] = (rows, size)
+            self.nbytes += size
+            self._shrink()
+        return rows
+
+    def clear(self) -> None:
+        """Drop all the listings and reset counters."""
+        with self._lock:
+            self._rows.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def resize(self, maxsize: int, maxbytes: Optional[int] = None) -> None:
+        """Change the cache size limits."""
+        with self._lock:
+            self.maxsize = maxsize
+            if maxbytes is not None:
+                self.maxbytes = maxbytes
+            self._shrink()
+
+    def info(self) -> Dict:
+        """Cache statistics."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._rows),
+                    'bytes': self.nbytes,
+                    'maxsize': self.maxsize,
+                    'maxbytes': self.maxbytes
+                    }
+
+    def _shrink(self) -> None:
+        """Drop the least recently used slices over the limits, the caller holds the lock."""
+        while self._rows and (len(self._rows) > max(self.maxsize, 0) or
+                              self.nbytes > self.maxbytes):
+            _, (_, size) = self._rows.popitem(last=False)
+            self.nbytes -= size
+
+
+def rows_size(rows: List) -> int:
+    """Approximate memory of the paper rows in bytes."""
+    size = 0
+    for row in rows:
+        for value in row:
+            size += getsizeof(value)
+            if isinstance(value, list):
+                size += sum(getsizeof(item) for item in value)
+    return size
+
+
+listing_cache = ListingCache()
+
+
+class FeedCache:
+    """
+    Process-wide LRU cache of the rendered RSS feeds, one per user.
+
+    The feed is stored with its version (ETag), a feed with another version is a miss.
+    The size is limited both in number of feeds and in bytes.
+    """
+    def __init__(self, maxsize: int = 1024, maxbytes: int = 64 * 2 ** 20):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._feeds = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id: int, version: str) -> Optional[bytes]:
+        """Get the user feed of the given version."""
+        with self._lock:
+            cached = self._feeds.get(user_id)
+            if cached is not None and cached[0] == version:
+                self._feeds.move_to_end(user_id)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            return None
+
+    def put(self, user_id: int, version: str, feed: bytes) -> None:
+        """Store the user feed, the previous version is replaced."""
+        if self.maxsize <= 0 or len(feed) > self.maxbytes:
+            return
+        with self._lock:
+            self._drop(user_id)
+            self._feeds[user_id] = (version, feed)
+            self.nbytes += len(feed)
+            self._shrink()
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop the user feed, e.g. at the tag change."""
+        with self._lock:
+            self._drop(user_id)
+
+    def clear(self) -> None:
+        """Drop all the feeds and reset counters."""
+        with self._lock:
+            self._feeds.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def resize(self, maxsize: int, maxbytes: int) -> None:
+        """Change the cache size limits."""
+        with self._lock:
+            self.maxsize = maxsize
+            self.maxbytes = maxbytes
+            self._shrink()
+
+    def info(self) -> Dict:
+        """Cache statistics."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / requests if requests else 0.,
+                    'size': len(self._feeds),
+                    'bytes': self.nbytes,
+                    'maxsize': self.maxsize,
+                    'maxbytes': self.maxbytes
+                    }
+
+    def _drop(self, user_id: int) -> None:
+        """Drop the feed, the lock is acquired by the caller."""
+        cached = self._feeds.pop(user_id, None)
+        if cached is not None:
+            self.nbytes -= len(cached[1])
+
+    def _shrink(self) -> None:
+        """Drop the least recently used feeds over the limits, the caller holds the lock."""
+        while self._feeds and (len(self._feeds) > max(self.maxsize, 0) or
+                               self.nbytes > self.maxbytes):
+            _, (_, feed) = self._feeds.popitem(last=False)
+            self.nbytes -= len(feed)
+
+
+feed_cache = FeedCache()
 
 
 def get_papers(cats: List[str],
                old_date: datetime,
-               new_date: datetime
+               new_date: datetime,
+               with_abstract: bool = True,
+               cached: bool = True
                ) -> List[PaperInterface]:
-    """Get list of papers from DB."""
-    paper_query = get_papers_from_db(cats, old_date, new_date)
-    return [PaperInterface.from_paper(paper) for paper in paper_query]
+    """
+    Get list of papers from DB.
+
+    The ranges made of the announcement days are assembled from the cached day slices.
+    The ranges that are not repeated, e.g. since the last visit, shouldn't be cached.
+    """
+    days = announce_days(old_date, new_date) if cached and listing_cache.maxsize > 0 else None
+    if days:
+        rows = get_cached_rows(cats, days, with_abstract)
+    else:
+        rows = get_paper_rows_from_db(cats, old_date, new_date, with_abstract)
+    return [PaperInterface.from_row(row) for row in rows]
+
+
+def announce_days(old_date: datetime, new_date: datetime) -> Optional[List[date]]:
+    """
+    Announcement days with the submission periods making exactly the range.
+
+    None if the range is not made of the whole announcement days.
+    """
+    days = []
+    bound = old_date
+    day = old_date.date()
+    # the submission period starts at least 2 days before the announcement
+    while bound < new_date and day <= new_date.date() + timedelta(days=4):
+        if day.weekday() < 5 and get_arxiv_sub_start(day) == bound:
+            days.append(day)
+            bound = get_arxiv_sub_end(day)
+        day += timedelta(days=1)
+    if not days or bound != new_date:
+        return None
+    return days
+
+
+def get_cached_rows(cats: List[str], days: List[date], with_abstract: bool = True) -> List:
+    """
+    Assemble the paper rows from the per category and day slices of the listing cache.
+
+    The slices are half-open [start, end), so the papers at the day bounds are in one slice.
+    The start of the range is excluded as with the single range query.
+    """
+    harvest = get_old_update_date().last_harvest
+    range_start = get_arxiv_sub_start(days[0])
+    rows = {}
+    for day in days:
+        for cat in cats:
+            for row in listing_cache.get((cat, day, with_abstract, harvest),
+                                         partial(get_paper_rows_from_db,
+                                                 [cat],
+                                                 get_arxiv_sub_start(day),
+                                                 get_arxiv_sub_end(day),
+                                                 with_abstract,
+                                                 with_start=True
+                                                 )
+                                         ):
+                # cross-lists are in several slices
+                if row.date_up > range_start:
+                    rows[row.id] = row
+    return sorted(rows.values(), key=lambda row: row.date_up, reverse=True)
+
+
+def load_abstracts(papers: List[PaperInterface]) -> None:
+    """Fill the abstracts of the papers loaded without them."""
+    missing = [paper.id for paper in papers if paper.abstract is None]
+    if not missing:
+        return
+    abstracts = get_abstracts(missing)
+    for paper in papers:
+        if paper.abstract is None:
+            paper.abstract = abstracts.get(paper.id)
+
+
+def rules_need_abstract(rules: List[str]) -> bool:
+    """Check if any of the tag rules looks into the abstract."""
+    return any(leaf.prefix == 'abs'
+               for rule in rules
+               for leaf in compile_rule(rule).leaves()
+               )
 
 
 def get_unseen_papers(cats: List[str],
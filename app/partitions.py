@@ -0,0 +1,199 @@
+"""
+Range partitioning of the paper table on date_up.
+
+The paper table can be converted into a table with weekly partitions.
+The queries of the recent papers are pruned to one or two partitions,
+so the cache tables are not needed.
+
+The partitions are managed with the flask CLI
+flask partitions convert  -- one time migration of the existing table
+flask partitions create   -- create the partitions for the coming weeks
+flask partitions list     -- show the partitions
+
+The models follow PAPER_PARTITIONS, so "flask db migrate" keeps the converted schema.
+The partitions and the old table are skipped by the migration autogeneration.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from re import compile as re_compile
+from typing import List, Tuple
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from .interfaces.model import db, Paper
+
+partitions_cli = AppGroup('partitions', help='Manage the paper table partitions.')
+
+# the table is kept after the conversion, drop it manually
+OLD_SUFFIX = '_unpartitioned'
+# weekly, default partitions and the old table
+PARTITION_TABLE = re_compile(rf'^{Paper.__tablename__}(_p\d{{8}}|_default|{OLD_SUFFIX})$')
+
+
+def week_start(date: datetime) -> datetime:
+    """Monday midnight of the week."""
+    return datetime.combine(date.date() - timedelta(days=date.weekday()), datetime.min.time())
+
+
+def partition_name(start: datetime) -> str:
+    """Name of the weekly partition."""
+    return f'{Paper.__tablename__}_p{start:%Y%m%d}'
+
+
+def include_name(name: str, type_: str, parent_names) -> bool:
+    """Skip the partition tables in the migration autogeneration, see Migrate(include_name=...)."""
+    # pylint: disable=unused-argument
+    return type_ != 'table' or not PARTITION_TABLE.match(name)
+
+
+def is_partitioned() -> bool:
+    """Check if the paper table is partitioned."""
+    return db.session.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))'
+    ), {'table': Paper.__tablename__}).scalar()
+
+
+def list_partitions() -> List[Tuple[str, str]]:
+    """Name and range of the paper table partitions."""
+    return db.session.execute(text(
+        'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) '
+        'FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = to_regclass(:table) '
+        'ORDER BY child.relname'
+    ), {'table': Paper.__tablename__}).all()
+
+
+def create_partitions(start: datetime, until: datetime) -> List[str]:
+    """
+    Create the missing weekly partitions between the dates.
+
+    The partition covering the rows of the default partition can't be created,
+    such weeks are skipped with an error.
+    No commit is done.
+    """
+    existing = {name for name, _ in list_partitions()}
+    created = []
+    week = week_start(start)
+    while week < until:
+        name = partition_name(week)
+        if name not in existing:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(text(
+                        f'CREATE TABLE {name} PARTITION OF {Paper.__tablename__} '
+                        f"FOR VALUES FROM ('{week:%Y-%m-%d}') "
+                        f"TO ('{week + timedelta(days=7):%Y-%m-%d}')"
+                    ))
+                created.append(name)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception('Partition %s is not created', name)
+        week += timedelta(days=7)
+    return created
+
+
+def ensure_partitions() -> List[str]:
+    """Create the partitions for the coming PAPER_PARTITION_AHEAD weeks."""
+    now = datetime.now()
+    created = create_partitions(now,
+                                now + timedelta(weeks=current_app.config['PAPER_PARTITION_AHEAD'])
+                                )
+    if created:
+        logging.info('Paper partitions created: %s', ', '.join(created))
+    return created
+
+
+def convert_papers() -> int:
+    """
+    Convert the paper table into the table partitioned by weeks.
+
+    The partition key has to be a part of every unique constraint, so
+    1. the primary key is (id, date_up) and paper_id is unique per date_up
+    2. the foreign keys referencing papers are dropped
+    The papers are copied in one transaction,
+    the old table is kept with the _unpartitioned suffix.
+    Return the number of copied papers.
+    """
+    table = Paper.__tablename__
+    old_table = table + OLD_SUFFIX
+    if is_partitioned():
+        logging.info('The paper table is already partitioned')
+        return 0
+
+    # the references are not possible without the partition key
+    for ref_table, name in db.session.execute(text(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = to_regclass(:table)"
+    ), {'table': table}):
+        db.session.execute(text(f'ALTER TABLE {ref_table} DROP CONSTRAINT {name}'))
+
+    # free the index and constraint names for the new table
+    for (name,) in db.session.execute(text(
+            'SELECT indexname FROM pg_indexes WHERE tablename = :table'
+    ), {'table': table}):
+        db.session.execute(text(f'ALTER INDEX {name} RENAME TO {name}{OLD_SUFFIX}'))
+    db.session.execute(text(f'ALTER TABLE {table} RENAME TO {old_table}'))
+
+    db.session.execute(text(
+        f'CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS) '
+        'PARTITION BY RANGE (date_up)'
+    ))
+    # keep the id sequence when the old table is dropped
+    sequence = db.session.execute(text('SELECT pg_get_serial_sequence(:table, :column)'),
+                                  {'table': old_table, 'column': 'id'}).scalar()
+    if sequence:
+        db.session.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id'))
+    db.session.execute(text(
+        f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, date_up)'
+    ))
+    db.session.execute(text(
+        f'ALTER TABLE {table} ADD CONSTRAINT {table}_paper_id_key UNIQUE (paper_id, date_up)'
+    ))
+    for index in Paper.__table__.indexes:
+        index.create(db.session.connection())
+
+    # rows outside the weekly partitions e.g. too old papers
+    db.session.execute(text(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT'))
+    first_paper = db.session.execute(text(f'SELECT min(date_up) FROM {old_table}')).scalar()
+    now = datetime.now()
+    create_partitions(first_paper or now,
+                      now + timedelta(weeks=current_app.config['PAPER_PARTITION_AHEAD'])
+                      )
+
+    columns = ', '.join(column.key for column in Paper.__table__.columns)
+    n_papers = db.session.execute(text(
+        f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {old_table}'
+    )).rowcount
+    db.session.commit()
+
+    logging.info('Paper table is partitioned: %i papers copied', n_papers)
+    return n_papers
+
+
+@partitions_cli.command('convert')
+def convert_command():
+    """Convert the paper table into weekly partitions."""
+    n_papers = convert_papers()
+    click.echo(f'{n_papers} papers copied. '
+               f'The old table is kept as {Paper.__tablename__}{OLD_SUFFIX}')
+
+
+@partitions_cli.command('create')
+@click.option('--weeks', type=int, default=None, help='Number of weeks ahead.')
+def create_command(weeks):
+    """Create the partitions for the coming weeks."""
+    if weeks is not None:
+        current_app.config['PAPER_PARTITION_AHEAD'] = weeks
+    created = ensure_partitions()
+    db.session.commit()
+    click.echo(f'{len(created)} partitions created')
+
+
+@partitions_cli.command('list')
+def list_command():
+    """Show the paper table partitions."""
+    for name, bound in list_partitions():
+        click.echo(f'{name}\t{bound}')
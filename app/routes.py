@@ -3,24 +3,31 @@
 import logging
 from datetime import datetime, timezone, timedelta
 from json import dumps, loads
+from typing import List, Dict, Optional, Tuple
 
 from flask import Blueprint, render_template, session, redirect, request, jsonify, url_for
 from flask_login import current_user, login_required
 from flask_mail import Message
 from sqlalchemy import func
+from sqlalchemy.orm import lazyload
 
 from . import mail
 from .auth import new_default_list
 from .interfaces.data_structures import PaperResponse, PaperInterface, TagInterface
 from .interfaces.model import db, Paper, PaperList, paper_associate, Tag
 from .paper_api import get_arxiv_sub_start, get_announce_date, get_arxiv_announce_date, get_date_range
-from .papers import process_papers, get_papers, get_unseen_papers, tag_suitable
+from .paper_db import count_list_papers, get_list_page_from_db, get_paper_page_from_db
+from .papers import process_papers, get_papers, get_unseen_papers, compile_rule, load_abstracts, \
+    rules_need_abstract
 from .settings import default_data
-from .utils import render_title
-from .utils_app import get_lists_for_current_user, get_old_update_date, update_seen_papers
+from .utils import render_title, encode_token, decode_token, DecodeException
+from .utils_app import get_lists_for_current_user, get_old_update_date, update_seen_papers, \
+    listing_etag, not_modified, set_etag
 
 PAPERS_PAGE = 25
 RECENT_PAPER_RANGE = 10
+# the largest page of the paginated /data
+DATA_PAGE_MAX = 1000
 
 main_bp = Blueprint(
     'main_bp',
@@ -131,12 +138,33 @@ def paper_land():
 @main_bp.route('/data')
 @login_required
 def data():
-    """API for paper download and process."""
+    """
+    API for paper download and process.
+
+    With page_size (1 to DATA_PAGE_MAX) the papers are paginated with (date_up, id) cursors.
+    The counters are returned with the first page,
+    the next pages are requested with the returned cursor.
+    """
+    page_size = request.args.get('page_size', type=int)
+    if 'page_size' in request.args and (page_size is None or not 1 <= page_size <= DATA_PAGE_MAX):
+        logging.error('Wrong data page size %r', request.args['page_size'])
+        return dumps({'success': False}), 422
+
     announce_date = get_announce_date()
 
     # update the information about "seen" papers since the last visit
     update_recent_papers(announce_date)
 
+    tags_db = Tag.query.filter_by(user_id=current_user.id).order_by(Tag.order).all()
+    tags_inter = [TagInterface.from_tag(tag) for tag in tags_db]
+
+    # lists are required at front-end as there is an interface to add paper to any one
+    lists = get_lists_for_current_user()
+
+    etag, shortcut = data_shortcut(tags_db, tags_inter, lists, announce_date, page_size)
+    if shortcut:
+        return shortcut
+
     old_date_tmp, new_date_tmp, new_date = get_date_range(
         request.args['date'],
         announce_date,
@@ -168,10 +196,19 @@ def data():
     # define categories of interest
     cats = current_user.arxiv_cat
 
+    # the unseen papers are spread over several days, no pagination
+    if request.args['date'] == 'unseen':
+        page_size = None
+    # the abstracts are needed only for the first page or for the tags
+    with_abstract = not page_size or rules_need_abstract([tag.rule for tag in tags_inter])
+
     if request.args['date'] != 'unseen':
+        # the ranges of a single user are not shared in the listing cache
         response.papers = get_papers(cats,
                                      old_date,
-                                     new_date
+                                     new_date,
+                                     with_abstract,
+                                     cached=request.args['date'] not in ('last', 'range')
                                      )
     else:
         it_start = 0
@@ -193,11 +230,14 @@ def data():
             get_arxiv_announce_date(last_paper_date)
         )
         # new query in the paper DB. Attempt to find papers
+        old_date = last_paper_date - timedelta(days=int(request.args['date'] == 'today'),
+                                               weeks=int(request.args['date'] == 'week') +
+                                               4 * int(request.args['date'] == 'month'))
+        new_date = last_paper_date
         response.papers = get_papers(cats,
-                                     last_paper_date - timedelta(days=int(request.args['date'] == 'today'),
-                                                                 weeks=int(request.args['date'] == 'week') +
-                                                                       4 * int(request.args['date'] == 'month')),
-                                     last_paper_date
+                                     old_date,
+                                     new_date,
+                                     with_abstract
                                      )
 
     # error handler
@@ -205,7 +245,7 @@ def data():
     if len(response.papers) == 0 and \
             request.args['date'] not in ('last', 'unseen'):
         logging.warning('No papers suitable with request')
-        return jsonify(response.to_dict())
+        return set_etag(jsonify(response.to_dict()), etag)
 
     # store the info about last checked paper
     # descending paper order is assumed
@@ -217,9 +257,6 @@ def data():
         logging.debug('RV %r', format(current_user.recent_visit, 'b'))
         db.session.commit()
 
-    tags_db = Tag.query.filter_by(user_id=current_user.id).order_by(Tag.order).all()
-    tags_inter = [TagInterface.from_tag(tag) for tag in tags_db]
-
     process_papers(response,
                    tags_inter,
                    cats,
@@ -227,14 +264,107 @@ def data():
                    do_tag=True
                    )
 
+    # the counters are computed for the whole range, the papers are cut to the first page
+    if page_size:
+        response.papers.sort(key=lambda paper: (paper.date_up, paper.id), reverse=True)
+        if len(response.papers) > page_size:
+            response.cursor = encode_cursor(response,
+                                            old_date,
+                                            new_date,
+                                            response.papers[page_size - 1]
+                                            )
+        response.papers = response.papers[:page_size]
+        load_abstracts(response.papers)
+
     response.sort_papers('tag')
     response.render_title_precise(request.args['date'], old_date_tmp, new_date_tmp)
 
-    # lists are required at front-end as there is an interface to add paper to any one
-    lists = get_lists_for_current_user()
     response.lists = lists
 
-    return jsonify(response.to_dict())
+    return set_etag(jsonify(response.to_dict()), etag)
+
+
+def data_shortcut(tags_db: List[Tag],
+                  tags: List[TagInterface],
+                  lists: List[Dict],
+                  announce_date: datetime,
+                  page_size: Optional[int]
+                  ) -> Tuple:
+    """
+    ETag of the /data response and the response without the full listing.
+
+    The response is 304 for the unchanged listing or the next page for the cursor,
+    None otherwise.
+    """
+    # the listing is the same until the harvest or the user settings change
+    # "last" and "unseen" depend on the user visits as well
+    etag = listing_etag(tags_db,
+                        current_user.arxiv_cat,
+                        announce_date.date(),
+                        lists,
+                        current_user.last_paper if request.args.get('date') == 'last' else None,
+                        current_user.recent_visit if request.args.get('date') == 'unseen' else None
+                        )
+    unchanged = not_modified(etag)
+    if unchanged:
+        return etag, unchanged
+
+    if page_size and request.args.get('cursor'):
+        return etag, data_page(request.args['cursor'], page_size, tags, etag)
+
+    return etag, None
+
+
+def data_page(cursor: str, page_size: int, tags: List[TagInterface], etag: str):
+    """Next page of the paginated /data response, no counters."""
+    try:
+        position = decode_token(cursor)
+    except DecodeException:
+        logging.error('Wrong data cursor %r', cursor)
+        return dumps({'success': False}), 422
+
+    response = PaperResponse(datetime.fromisoformat(position['last_date']))
+    rows = get_paper_page_from_db(current_user.arxiv_cat,
+                                  datetime.fromisoformat(position['old_date']),
+                                  datetime.fromisoformat(position['new_date']),
+                                  (datetime.fromisoformat(position['date_up']), position['id']),
+                                  page_size + 1
+                                  )
+    response.papers = [PaperInterface.from_row(row) for row in rows[:page_size]]
+    if len(rows) > page_size:
+        response.cursor = encode_cursor(response,
+                                        datetime.fromisoformat(position['old_date']),
+                                        datetime.fromisoformat(position['new_date']),
+                                        response.papers[-1]
+                                        )
+
+    process_papers(response,
+                   tags,
+                   current_user.arxiv_cat,
+                   do_nov=True,
+                   do_tag=True
+                   )
+    # the counters are sent with the first page only
+    response.ncat = None
+    response.nnov = None
+    response.ntag = None
+
+    response.sort_papers('tag')
+    return set_etag(jsonify(response.to_dict()), etag)
+
+
+def encode_cursor(response: PaperResponse,
+                  old_date: datetime,
+                  new_date: datetime,
+                  paper: PaperInterface
+                  ) -> str:
+    """Cursor of the next /data page: the date range and the last paper on the page."""
+    return encode_token({'last_date': response.last_date.isoformat(),
+                         'old_date': old_date.isoformat(),
+                         'new_date': new_date.isoformat(),
+                         'date_up': paper.date_up.isoformat(),
+                         'id': paper.id
+                         })
 
 
 @main_bp.route('/about')
@@ -276,11 +406,13 @@ def bookshelf():
         logging.warning('%r tries to access list %r', current_user.id, display_list)
         return redirect(url_for(ROOT_BOOK, list_id=lists[0]['id']), code=303)
 
-    # get the particular paper list to access papers from one
-    paper_list = PaperList.query.filter_by(id=display_list).first()
+    # get the particular paper list, the papers are read page by page below
+    paper_list = PaperList.query.options(lazyload(PaperList.papers)
+                                         ).filter_by(id=display_list).first()
+    total_papers = count_list_papers(display_list)
 
     # too large page argument
-    if page > len(paper_list.papers) / PAPERS_PAGE + 1:
+    if page > total_papers / PAPERS_PAGE + 1:
         return redirect(url_for(ROOT_BOOK, list_id=lists[0]['id'], page=1), code=303)
 
     # reset number of unseen papers
@@ -288,9 +420,7 @@ def bookshelf():
     db.session.commit()
 
     response = PaperResponse()
-    response.papers = [PaperInterface.from_paper(paper) for paper in paper_list.papers]
 
-    total_papers = len(response.papers)
     total_pages = total_papers // PAPERS_PAGE
     total_pages += 1 if total_papers % PAPERS_PAGE else 0
 
@@ -298,15 +428,22 @@ def bookshelf():
     tags_db = Tag.query.filter_by(user_id=current_user.id).order_by(Tag.order).all()
     tags_inter = [TagInterface.from_tag(tag) for tag in tags_db]
 
-    # sort and truncate papers before processing for the optimisation
+    # sort and truncate papers in the DB before processing for the optimisation
+    # the tags are assigned after the truncation
+    # so the tag order falls back to the date_up order
     sort_key = 'tag'
     reverse = True
     if 'sort' in request.args:
         sort_args = request.args['sort'].split('_')
         sort_key = sort_args[0]
         reverse = sort_args[1] == 'as'
-    response.sort_papers(sort_key, reverse)
-    response.papers = response.papers[PAPERS_PAGE * (page - 1):][:PAPERS_PAGE]
+    rows = get_list_page_from_db(display_list,
+                                 sort_key,
+                                 reverse,
+                                 PAPERS_PAGE * (page - 1),
+                                 PAPERS_PAGE
+                                 )
+    response.papers = [PaperInterface.from_row(row) for row in rows]
     process_papers(response,
                    tags_inter,
                    current_user.arxiv_cat,
@@ -456,7 +593,7 @@ def test_tag():
         logging.error('Test tag request w/o rule')
         return dumps({'success': False}), 422
 
-    if tag_suitable(paper, request.args.get('rule')):
+    if compile_rule(request.args.get('rule')).evaluate(paper):
         return dumps({'result': True}), 200
 
     return dumps({'result': False}), 200
@@ -9,6 +9,7 @@ from flask_login import current_user, login_required
 
 from .interfaces.data_structures import TagInterface
 from .interfaces.model import db, Tag, PaperList
+from .papers import rule_cache, feed_cache
 from .utils import cast_args_to_dict, encode_token
 
 settings_bp = Blueprint(
@@ -81,6 +82,7 @@ def mod_cat():
     new_cats = cast_args_to_dict(request.form.to_dict().keys())
     current_user.arxiv_cat = new_cats
     db.session.commit()
+    feed_cache.invalidate(current_user.id)
     return dumps({'success': True}), 201
 
 
@@ -89,6 +91,7 @@ def mod_cat():
 def mod_tag():
     """Apply tag changes."""
     args = request.form.to_dict().keys()
+    feed_cache.invalidate(current_user.id)
     return modify_settings(args,
                            Tag,
                            new_tag,
@@ -230,6 +233,9 @@ def modify_settings(args, db_class, new_db_object, update, set_place):
 def update_tag(old_tag: Tag, tag: Tag, order: int):
     """Update Tag record in database."""
     print(tag)
+    # never serve the matcher compiled for the outdated rule
+    if old_tag.rule and old_tag.rule != tag['rule']:
+        rule_cache.invalidate(old_tag.rule)
     old_tag.name = tag['name']
     old_tag.rule = tag['rule']
     old_tag.color = tag['color']
@@ -2,13 +2,20 @@
 
 import logging
 import smtplib
-from typing import List, Dict
+from datetime import datetime
+from hashlib import sha1
+from time import perf_counter
+from typing import List, Dict, Optional
 
+from flask import request, make_response, Response, g, current_app
 from flask_login import current_user
 from flask_mail import Message
+from sqlalchemy import func, not_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import lazyload
 
 from . import mail
-from .interfaces.model import PaperList, db, UpdateDate
+from .interfaces.model import PaperList, db, UpdateDate, Tag, Paper, ShardRun, Job
 from .utils import month_start
 
 
@@ -55,9 +62,11 @@ def get_lists_for_current_user() -> List[Dict]:
 
 def get_or_create_list(user_id, name) -> PaperList:
     """Find a list for a user in DB. If no, create one."""
-    paper_list = PaperList.query.filter_by(user_id=user_id,
-                                           name=name
-                                           ).first()
+    # the list papers are not needed, skip the eager load
+    paper_list = PaperList.query.options(lazyload(PaperList.papers)
+                                         ).filter_by(user_id=user_id,
+                                                     name=name
+                                                     ).first()
 
     if not paper_list:
         paper_list = PaperList(name=name,
@@ -85,9 +94,119 @@ def get_old_update_date() -> UpdateDate:
     return old_date_record
 
 
+def start_shard_run(job: str, since: datetime, shards: int) -> Optional[datetime]:
+    """
+    Date of the last paper processed by the job run.
+
+    The first shard of the run fixes it, so all the shards process the same papers.
+    The run is committed immediately, so the other shards are not blocked.
+    """
+    until = db.session.query(func.max(Paper.date_up)).scalar()
+    if shards == 1:
+        return until
+
+    db.session.execute(pg_insert(ShardRun).values(job=job,
+                                                  since=since,
+                                                  shards=shards,
+                                                  until=until,
+                                                  done=[]
+                                                  ).on_conflict_do_nothing())
+    db.session.commit()
+    run = db.session.execute(select(ShardRun.shards, ShardRun.until).filter_by(job=job,
+                                                                           since=since
+                                                                           )).first()
+    if run.shards != shards:
+        raise ValueError(f'The {job} run started with {run.shards} shards')
+    return run.until
+
+
+def finish_shard(job: str, since: datetime, shard: int, shards: int) -> bool:
+    """
+    Mark the shard of the job run as done.
+
+    True if all the shards are done, then the job watermark could be moved.
+    No commit is done, the shards are serialized by the run row lock.
+    """
+    if shards == 1:
+        return True
+
+    runs = ShardRun.__table__
+    done = db.session.execute(runs.update().where(
+        runs.columns.job == job,
+        runs.columns.since == since,
+        not_(runs.columns.done.any(shard))
+    ).values(
+        done=func.array_append(runs.columns.done, shard)
+    ).returning(func.cardinality(runs.columns.done))).scalar()
+    if done is None or done < shards:
+        return False
+
+    # keep only the last run for the inspection
+    db.session.execute(runs.delete().where(runs.columns.job == job,
+                                           runs.columns.since < since
+                                           ))
+    return True
+
+
+def job_progress(**counts):
+    """
+    Report the progress of the background job, e.g. job_progress(users=10).
+
+    Nothing is done outside of the job worker.
+    The progress is written in a separate transaction at most every JOB_PROGRESS_PERIOD seconds,
+    the last counters are stored when the job is finished.
+    """
+    if g.get('job_id') is None:
+        return
+    g.job_progress = {**g.get('job_progress', {}), **counts}
+    now = perf_counter()
+    if now - g.get('job_progress_time', 0.) < current_app.config['JOB_PROGRESS_PERIOD']:
+        return
+    g.job_progress_time = now
+
+    jobs = Job.__table__
+    with db.engine.begin() as connection:
+        connection.execute(jobs.update().where(jobs.columns.id == g.job_id
+                                               ).values(progress=g.job_progress))
+
+
 def update_seen_papers(it_start: int, it_end: int):
     """Update "seen" papers."""
     for i in range(it_start, it_end + 1):
         # prevent underflow by 1
         i = max(i, 0)
         current_user.recent_visit = current_user.recent_visit | 2 ** i
+
+
+def listing_etag(tags: List[Tag], cats: List[str], *parts) -> str:
+    """
+    ETag of the paper listing.
+
+    The listing changes with the harvest, the user tags and categories and the request.
+    """
+    version = (get_old_update_date().last_harvest,
+               [(tag.id, tag.order, tag.name, tag.rule, tag.color, tag.userss) for tag in tags],
+               cats,
+               sorted(request.args.items(multi=True)),
+               parts
+               )
+    return sha1(repr(version).encode()).hexdigest()
+
+
+def not_modified(etag: str) -> Optional[Response]:
+    """Response 304 if the client has the same listing version."""
+    if etag not in request.if_none_match:
+        return None
+    response = make_response('', 304)
+    set_etag(response, etag)
+    return response
+
+
+def set_etag(response: Response, etag: str) -> Response:
+    """Make the client to revalidate the listing with the ETag."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    last_harvest = get_old_update_date().last_harvest
+    if last_harvest:
+        response.last_modified = last_harvest
+    return response
@@ -44,6 +44,37 @@ class Config:
     ORCID_URL = environ.get('ORCID_URL')
     ORCID_SECRET = environ.get('ORCID_SEC')
 
+    # number of compiled tag rules kept in memory
+    TAG_RULE_CACHE_SIZE = int(environ.get('TAG_RULE_CACHE_SIZE', 1024))
+
+    # number and total size of the (category, announcement day) paper listings kept in memory,
+    # 0 disables the cache
+    LISTING_CACHE_SIZE = int(environ.get('LISTING_CACHE_SIZE', 256))
+    LISTING_CACHE_BYTES = int(environ.get('LISTING_CACHE_BYTES', 64 * 2 ** 20))
+    # number and total size of the rendered RSS feeds kept in memory, 0 disables the cache
+    RSS_CACHE_SIZE = int(environ.get('RSS_CACHE_SIZE', 1024))
+    RSS_CACHE_BYTES = int(environ.get('RSS_CACHE_BYTES', 64 * 2 ** 20))
+
+    # papers are stored in the table partitioned by weeks on date_up
+    # the table is converted with "flask partitions convert", the cache tables are not used
+    # the models depend on it, so it's read once from the environment, not from the app config,
+    # see PAPER_PARTITIONS in app/interfaces/model.py
+    PAPER_PARTITIONS = environ.get('PAPER_PARTITIONS', 'False').lower() == 'true'
+    # number of weeks with the partitions created in advance
+    PAPER_PARTITION_AHEAD = int(environ.get('PAPER_PARTITION_AHEAD', 4))
+
+    # the hooks are put to the jobs table and run by "flask jobs worker"
+    JOB_QUEUE = environ.get('JOB_QUEUE', 'False').lower() == 'true'
+    # seconds between the worker polls of the empty queue
+    JOB_POLL = float(environ.get('JOB_POLL', 5))
+    # minimal seconds between the job progress writes
+    JOB_PROGRESS_PERIOD = float(environ.get('JOB_PROGRESS_PERIOD', 1))
+    # seconds between the heartbeats of the running job
+    JOB_HEARTBEAT = float(environ.get('JOB_HEARTBEAT', 60))
+    # running job without a heartbeat for this number of seconds is marked failed,
+    # e.g. the worker is killed
+    JOB_TIMEOUT = float(environ.get('JOB_TIMEOUT', 600))
+
     # arXiv timing
     time_str = environ.get('ARXIV_UPDATE_TIME', '6:30')
     ARXIV_UPDATE_TIME = datetime.strptime(time_str,
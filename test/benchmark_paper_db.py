@@ -0,0 +1,114 @@
+"""
+Benchmark of the paper listing queries.
+
+Latency of get_papers_from_db() for today/week/month ranges
+on a synthetic multi-year corpus with and without the cats/date_up indices.
+The corpus is stored in the DB of SERVER_CONF and deleted at the end.
+
+python -m test.benchmark_paper_db --years 5 --per-day 300
+"""
+
+import argparse
+import random
+from datetime import datetime, timedelta
+from statistics import median
+from time import perf_counter
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import app_init
+from app.interfaces.model import db, Paper
+from app.paper_db import get_papers_from_db
+from app.utils_app import get_old_update_date
+
+PREFIX = 'bench_'
+CATS = [f'{archive}.{sub}' for archive in ('astro-ph', 'cond-mat', 'cs', 'math', 'physics')
+        for sub in ('AA', 'BB', 'CC', 'DD', 'EE', 'FF', 'GG', 'HH')
+        ] + ['hep-ex', 'hep-ph', 'hep-th', 'hep-lat', 'gr-qc', 'nucl-ex', 'nucl-th', 'quant-ph']
+USER_CATS = ['hep-ex', 'hep-ph', 'astro-ph.CC']
+RANGES = {'today': 1, 'week': 7, 'month': 30}
+INDICES = ('ix_papers_cats', 'ix_papers_date_up')
+
+
+def fill_corpus(years: int, per_day: int):
+    """Store the synthetic papers."""
+    now = datetime.now()
+    rows = []
+    for num in range(years * 365 * per_day):
+        date = now - timedelta(minutes=random.randrange(years * 365 * 24 * 60))
+        rows.append({'paper_id': f'{PREFIX}{num}',
+                     'title': f'Synthetic paper {num}',
+                     'author': ['A. Author', 'B. Author'],
+                     'author_text': 'a. author, b. author',
+                     'date_up': date,
+                     'date_sub': date,
+                     'version': 'v1',
+                     'abstract': 'Synthetic abstract',
+                     'cats': random.sample(CATS, random.randint(1, 3)),
+                     'source': 1
+                     })
+        if len(rows) == 10000:
+            db.session.execute(pg_insert(Paper).values(rows))
+            rows = []
+    if rows:
+        db.session.execute(pg_insert(Paper).values(rows))
+    db.session.commit()
+    db.session.execute(text('ANALYZE papers'))
+
+
+def measure(repeat: int) -> dict:
+    """Median latency per date range in ms."""
+    now = datetime.now()
+    result = {}
+    for name, days in RANGES.items():
+        timing = []
+        for _ in range(repeat):
+            start = perf_counter()
+            get_papers_from_db(USER_CATS, now - timedelta(days=days), now)
+            timing.append((perf_counter() - start) * 1000)
+        result[name] = median(timing)
+    return result
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--per-day', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = app_init()
+    with app.app_context():
+        db.create_all()
+        fill_corpus(args.years, args.per_day)
+        try:
+            # the paper table is measured, not the caches
+            old_date_record = get_old_update_date()
+            old_date_record.first_paper_day_cache = None
+            old_date_record.first_paper_weeks_cache = None
+
+            # the indices are dropped inside the transaction and restored with the rollback
+            for index in INDICES:
+                db.session.execute(text(f'DROP INDEX IF EXISTS {index}'))
+            before = measure(args.repeat)
+            db.session.rollback()
+
+            old_date_record = get_old_update_date()
+            old_date_record.first_paper_day_cache = None
+            old_date_record.first_paper_weeks_cache = None
+            after = measure(args.repeat)
+            db.session.rollback()
+        finally:
+            db.session.execute(Paper.__table__.delete().where(Paper.paper_id.startswith(PREFIX)))
+            db.session.commit()
+
+    print(f'{args.years * 365 * args.per_day} papers, median of {args.repeat} requests')
+    print('range\tno index, ms\tindex, ms')
+    for name in RANGES:
+        print(f'{name}\t{before[name]:.1f}\t{after[name]:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,23 @@
+from datetime import datetime, timedelta
+from io import BytesIO
 from json import loads
+from threading import Thread, Event
+from time import sleep
 
 import pytest
 import requests_mock
 import urllib3
 from flask import url_for
 
-from app import db, mail
-from app.interfaces.model import UpdateDate
+from app import db, mail, paper_db
+from app.interfaces.model import UpdateDate, Paper, PaperCacheDay, PaperList, Tag, ShardRun, Job
+from app.jobs import run_next_job
+from app.paper_db import update_paper_per_api, update_paper_per_api_pipeline, \
+    update_paper_per_api_bulk, refresh_paper_cache, add_list_papers, store_papers
 from app.paper_api import ArxivOaiApi
+from app.papers import feed_cache
 from app.utils import encode_token
+from app.utils_app import get_old_update_date, get_or_create_list
 from test.conftest import TMP_EMAIL, EMAIL
 from test.test_response import ROOT_LOAD, ROOT_BM_USER, ROOT_DEL_PAPERS
 
@@ -250,3 +259,563 @@ def test_exception_throw():
         papers = list(api.download_papers())
         assert len(papers) == 0
         assert api.fail_attempts > api.MAX_FAIL
+
+
+OAI_PAGE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+<ListRecords>
+<record><header><identifier>oai:arXiv.org:2101.00001</identifier></header>
+<metadata><arXivRaw xmlns="http://arxiv.org/OAI/arXivRaw/">
+<id>2101.00001</id>
+<version version="v1"><date>Mon, 4 Jan 2021 10:00:00 GMT</date></version>
+<version version="v2"><date>Tue, 5 Jan 2021 11:00:00 GMT</date></version>
+<title>Heavy neutrino search</title>
+<authors>A. Author, B. Author</authors>
+<categories>hep-ex hep-ph</categories>
+<abstract>Look for neutrino with heavy detector</abstract>
+</arXivRaw></metadata></record>
+<record><header><identifier>oai:arXiv.org:2101.00002</identifier></header>
+<metadata><arXivRaw xmlns="http://arxiv.org/OAI/arXivRaw/">
+<id>2101.00002</id>
+<doi>10.1000/xyz123 10.1000/other</doi>
+<version version="v1"><date>Mon, 4 Jan 2021 12:00:00 GMT</date></version>
+<title>Dark matter</title>
+<authors>C. Author and D. Author</authors>
+<categories>astro-ph.CO</categories>
+<abstract>Breakthrough is coming</abstract>
+</arXivRaw></metadata></record>
+<resumptionToken cursor="0" completeListSize="2"></resumptionToken>
+</ListRecords>
+</OAI-PMH>
+"""
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_download_page(stream):
+    """Test the OAI page parsing with and without streaming."""
+    with requests_mock.Mocker(real_http=False) as mock_api:
+        mock_api.get('http://export.arxiv.org/oai2', content=OAI_PAGE)
+
+        api = ArxivOaiApi(stream=stream)
+        papers = list(api.download_papers(rest=2))
+
+    assert [paper.paper_id for paper in papers] == ['2101.00001', '2101.00002']
+    assert papers[0].version == 'v2'
+    assert papers[0].date_up > papers[0].date_sub
+    assert papers[0].author == ['A. Author', 'B. Author']
+    assert papers[1].doi == '10.1000/xyz123'
+    assert papers[1].cats == ['astro-ph.CO']
+
+
+def test_download_resumption(mocker):
+    """Test the harvester follows the resumption token and retries the failed page."""
+    first_page = OAI_PAGE.replace(b'cursor="0" completeListSize="2"></resumptionToken>',
+                                  b'cursor="0" completeListSize="3">token_1</resumptionToken>')
+    second_page = OAI_PAGE.replace(b'2101.00001', b'2101.00003')
+    second_record = second_page.index(b'<record><header><identifier>oai:arXiv.org:2101.00002')
+    second_page = second_page[:second_record] + \
+        b'<resumptionToken cursor="1000" completeListSize="3"></resumptionToken>' + \
+        b'</ListRecords></OAI-PMH>'
+    mocker.patch('app.paper_api.sleep')
+
+    with requests_mock.Mocker(real_http=False) as mock_api:
+        mock_api.get('http://export.arxiv.org/oai2',
+                     [{'content': first_page},
+                      {'status_code': 503, 'headers': {'Retry-After': '1'}},
+                      {'content': second_page}
+                      ])
+
+        api = ArxivOaiApi()
+        papers = list(api.download_papers())
+
+    assert [paper.paper_id for paper in papers] == ['2101.00001', '2101.00002', '2101.00003']
+    assert api.fail_attempts == 1
+    assert 'resumptionToken=token_1' in mock_api.request_history[-1].url
+
+
+def test_download_stream_retry(mocker):
+    """Test the broken stream is requested again without the repeated papers."""
+    broken_page = OAI_PAGE[:OAI_PAGE.index(b'<title>Dark matter')]
+    mocker.patch('app.paper_api.sleep')
+
+    with requests_mock.Mocker(real_http=False) as mock_api:
+        mock_api.get('http://export.arxiv.org/oai2',
+                     [{'content': broken_page},
+                      {'content': OAI_PAGE}
+                      ])
+
+        api = ArxivOaiApi(stream=True)
+        papers = list(api.download_papers(rest=2))
+
+    assert [paper.paper_id for paper in papers] == ['2101.00001', '2101.00002']
+    assert api.fail_attempts == 1
+
+    # the response is closed when the harvest is stopped early
+    response = mocker.Mock(raw=BytesIO(OAI_PAGE))
+    page = api.stream_page(response)
+    next(page)
+    page.close()
+    response.close.assert_called_once()
+
+
+def test_download_pipeline(app, mocker):
+    """Test the pipelined harvest stores the papers from all the pages."""
+    first_page = OAI_PAGE.replace(b'2101.00001', b'2101.90001')
+    first_page = first_page.replace(b'2101.00002', b'2101.90002')
+    first_page = first_page.replace(b'cursor="0" completeListSize="2"></resumptionToken>',
+                                    b'cursor="0" completeListSize="4">token_1</resumptionToken>')
+    second_page = OAI_PAGE.replace(b'2101.00001', b'2101.90003')
+    second_page = second_page.replace(b'2101.00002', b'2101.90004')
+    mocker.patch('app.paper_api.sleep')
+
+    with requests_mock.Mocker(real_http=False) as mock_api:
+        mock_api.get('http://export.arxiv.org/oai2',
+                     [{'content': first_page},
+                      {'content': second_page}
+                      ])
+
+        with app.app_context():
+            timing = update_paper_per_api_pipeline(ArxivOaiApi(),
+                                                   last_paper_date=datetime(2000, 1, 1),
+                                                   pipeline=True
+                                                   )
+            ids = [f'2101.9000{i}' for i in range(1, 5)]
+            stored = Paper.query.filter(Paper.paper_id.in_(ids)).all()
+            assert sorted(paper.paper_id for paper in stored) == ids
+            for paper in stored:
+                db.session.delete(paper)
+            db.session.commit()
+
+    assert set(timing) == {'fetch', 'parse', 'store'}
+
+
+class PipelineApi:
+    """Fake API with many pages for the pipeline stoppers."""
+    def __init__(self, n_pages: int = 50, fail: bool = False):
+        """Set the number of pages and the connection drop on the second page."""
+        self.n_pages = n_pages
+        self.fail = fail
+
+    def fetch_pages(self):
+        """Yield the page numbers with the download delay."""
+        for page in range(self.n_pages):
+            if self.fail and page == 1:
+                raise ConnectionError('Connection dropped')
+            # the parse stage waits for the slow download
+            sleep(0.1)
+            yield page
+
+    @staticmethod
+    def parse_content(page):
+        """Two fresh papers per page."""
+        now = datetime.now()
+        return [Paper(paper_id=f'pipeline_{page}_{num}',
+                      title='Pipeline test',
+                      author=['Author'],
+                      date_up=now,
+                      date_sub=now,
+                      version='v1',
+                      source=1
+                      ) for num in range(2)]
+
+
+def run_with_timeout(app, funct, timeout: float = 30):
+    """Run in a thread with the app context, fail if the call hangs."""
+    result = {}
+
+    def target():
+        with app.app_context():
+            try:
+                result['value'] = funct()
+            except Exception as err:  # pylint: disable=broad-except
+                result['error'] = err
+
+    thread = Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive()
+    return result
+
+
+def test_download_pipeline_limit(app):
+    """Test the pipelined harvest stops at the paper limit."""
+    def harvest():
+        return update_paper_per_api_pipeline(PipelineApi(),
+                                             last_paper_date=datetime(2000, 1, 1),
+                                             n_papers=3
+                                             )
+
+    result = run_with_timeout(app, harvest)
+    assert 'error' not in result
+    with app.app_context():
+        query = Paper.query.filter(Paper.paper_id.like('pipeline_%'))
+        assert 3 < query.count() < 50
+        query.delete(synchronize_session=False)
+        db.session.commit()
+
+
+def test_download_pipeline_error(app):
+    """Test the fetch error of the pipelined harvest is raised."""
+    def harvest():
+        return update_paper_per_api_pipeline(PipelineApi(fail=True),
+                                             last_paper_date=datetime(2000, 1, 1)
+                                             )
+
+    result = run_with_timeout(app, harvest)
+    assert isinstance(result['error'], ConnectionError)
+    with app.app_context():
+        Paper.query.filter(Paper.paper_id.like('pipeline_%')).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def test_download_bulk(app):
+    """Test the bulk upsert counts the new and updated papers."""
+    page = OAI_PAGE.replace(b'2101.00001', b'2101.80001').replace(b'2101.00002', b'2101.80002')
+
+    with requests_mock.Mocker(real_http=False) as mock_api:
+        mock_api.get('http://export.arxiv.org/oai2', content=page)
+
+        with app.app_context():
+            params = {'last_paper_date': datetime(2000, 1, 1)}
+            assert update_paper_per_api_bulk(ArxivOaiApi(), **params) == (2, 0)
+            assert update_paper_per_api_bulk(ArxivOaiApi(), **params) == (0, 0)
+            assert update_paper_per_api_bulk(ArxivOaiApi(), do_update=True, **params) == (0, 2)
+
+            stored = Paper.query.filter(Paper.paper_id.in_(['2101.80001', '2101.80002'])).all()
+            assert len(stored) == 2
+            assert all(paper.author_text for paper in stored)
+            for paper in stored:
+                db.session.delete(paper)
+            db.session.commit()
+
+
+def test_download_batch_lookup(app):
+    """Test the batched paper lookup keeps the n_papers limit and the duplicates."""
+    page = OAI_PAGE.replace(b'2101.00001', b'2101.70001').replace(b'2101.00002', b'2101.70001')
+
+    with requests_mock.Mocker(real_http=False) as mock_api:
+        mock_api.get('http://export.arxiv.org/oai2', content=page)
+
+        with app.app_context():
+            params = {'last_paper_date': datetime(2000, 1, 1)}
+            # the same paper twice in a page
+            assert update_paper_per_api(ArxivOaiApi(), do_update=True, **params) == (1, 1)
+            assert update_paper_per_api(ArxivOaiApi(), n_papers=1, **params) == (0, 0)
+            # the limit allows one more paper to be stored
+            params['n_papers'] = 1
+            assert update_paper_per_api(ArxivOaiApi(), do_update=True, **params) == (0, 2)
+
+            stored = Paper.query.filter_by(paper_id='2101.70001').all()
+            assert len(stored) == 1
+            db.session.delete(stored[0])
+            db.session.commit()
+
+
+def test_fill_authors_command(app):
+    """Test the author search text of the old papers is filled by the CLI command."""
+    with app.app_context():
+        db.session.add(Paper(paper_id='2101.80002',
+                             title='Author text test',
+                             author=['Au1', 'Au2'],
+                             date_up=datetime(2021, 1, 1),
+                             date_sub=datetime(2021, 1, 1),
+                             version='v1',
+                             source=1
+                             ))
+        # stored before the column was introduced
+        Paper.query.filter_by(paper_id='2101.80002').update({Paper.author_text: None})
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['papers', 'fill-authors'])
+        assert 'filled for 1 papers' in result.output
+        paper = Paper.query.filter_by(paper_id='2101.80002').first()
+        assert paper.author_text == 'au1, au2'
+        db.session.delete(paper)
+        db.session.commit()
+
+
+def test_store_papers_partitions(app, monkeypatch):
+    """Test the concurrent harvests don't add the same paper twice without the unique paper id."""
+    def paper(date_up: datetime) -> Paper:
+        return Paper(paper_id='2101.80001',
+                     title='Partition test',
+                     author=['Author'],
+                     date_up=date_up,
+                     date_sub=date_up,
+                     version='v1',
+                     source=1
+                     )
+
+    stored = Event()
+    # the paper ids are locked with the partitioned table only
+    monkeypatch.setattr(paper_db, 'PAPER_PARTITIONS', True)
+
+    def first_harvest():
+        with app.app_context():
+            assert store_papers([paper(datetime(2021, 1, 1))], do_update=True) == (1, 0)
+            db.session.flush()
+            stored.set()
+            # the second harvest waits for the commit
+            sleep(0.5)
+            db.session.commit()
+
+    thread = Thread(target=first_harvest)
+    thread.start()
+    with app.app_context():
+        assert stored.wait(timeout=30)
+        assert store_papers([paper(datetime(2021, 1, 2))], do_update=True) == (0, 1)
+        db.session.commit()
+        thread.join()
+
+        papers = Paper.query.filter_by(paper_id='2101.80001').all()
+        assert len(papers) == 1
+        assert papers[0].date_up == datetime(2021, 1, 2)
+        db.session.delete(papers[0])
+        db.session.commit()
+
+
+def test_add_list_papers(user):
+    """Test the bulk bookmarks skip the papers already in the list."""
+    now = datetime.now()
+    papers = [Paper(paper_id=f'bulk_bm_{num}',
+                    title='Bulk bookmark',
+                    author=['Author'],
+                    date_up=now,
+                    date_sub=now,
+                    version='v1',
+                    source=1
+                    ) for num in range(3)]
+    db.session.add_all(papers)
+    db.session.commit()
+    paper_list = get_or_create_list(user.id, 'bulk')
+
+    bookmarks = [(paper_list.id, paper.id) for paper in papers]
+    assert add_list_papers(bookmarks[:2]) == {paper_list.id: 2}
+    # the duplicates are skipped
+    assert add_list_papers(bookmarks + bookmarks) == {paper_list.id: 1}
+    db.session.commit()
+    paper_list = PaperList.query.filter_by(id=paper_list.id).first()
+    assert paper_list.not_seen == 3
+    assert len(paper_list.papers) == 3
+
+    for paper in papers:
+        db.session.delete(paper)
+    db.session.delete(paper_list)
+    db.session.commit()
+
+
+def test_bookmark_shards(client, user):
+    """Test the bookmark watermark moves when all the shards are done."""
+    now = datetime.now()
+    paper = Paper(paper_id='shard_test',
+                  title='Sharded bookmark',
+                  author=['Author'],
+                  date_up=now,
+                  date_sub=now,
+                  version='v1',
+                  source=1,
+                  cats=['hep-ex']
+                  )
+    db.session.add(paper)
+    db.session.add(Tag(name='shard',
+                       rule='ti{sharded}',
+                       color='#ffffff',
+                       bookmark=True,
+                       user_id=user.id
+                       ))
+    user.arxiv_cat = ['hep-ex']
+    old_date_record = get_old_update_date()
+    old_date = old_date_record.last_bookmark
+    old_date_record.last_bookmark = now - timedelta(days=1)
+    db.session.commit()
+
+    shard = user.id % 2
+    response = client.post(url_for('auto_bp.bookmark_papers', shard=1 - shard, shards=2),
+                           headers={"token": "test_token"}  # nosec
+                           )
+    assert not loads(response.data)['finished']
+    assert get_old_update_date().last_bookmark < now
+
+    response = client.post(url_for('auto_bp.bookmark_papers', shard=shard, shards=2),
+                           headers={"token": "test_token"}  # nosec
+                           )
+    assert loads(response.data)['finished']
+    assert loads(response.data)['users'] >= 1
+    assert get_old_update_date().last_bookmark >= now
+    assert paper in PaperList.query.filter_by(user_id=user.id, name='shard').first().papers
+
+    response = client.post(url_for('auto_bp.bookmark_papers', shard=2, shards=2),
+                           headers={"token": "test_token"}  # nosec
+                           )
+    assert response.status_code == 422
+
+    get_old_update_date().last_bookmark = old_date
+    ShardRun.query.delete()
+    PaperList.query.filter_by(user_id=user.id, name='shard').delete()
+    Tag.query.filter_by(user_id=user.id, name='shard').delete()
+    db.session.delete(paper)
+    db.session.commit()
+
+
+def test_job_queue(app, client):
+    """Test the hook is queued and run by the worker."""
+    app.config['JOB_QUEUE'] = True
+    response = client.post(url_for('auto_bp.delete_papers', until='2000-01-01', force=True),
+                           headers={"token": "test_token"}  # nosec
+                           )
+    app.config['JOB_QUEUE'] = False
+    assert response.status_code == 202
+    job_url = url_for('auto_bp.job_status', job_id=loads(response.data)['job'])
+
+    response = client.get(job_url, headers={"token": "test_token"})  # nosec
+    assert loads(response.data)['status'] == 'queued'
+
+    while run_next_job(app):
+        pass
+    job = loads(client.get(job_url, headers={"token": "test_token"}).data)  # nosec
+    assert job['status'] == 'done'
+    assert job['progress'] == {'deleted': 0}
+    assert job['result'] == {'success': True, 'deleted': 0}
+    assert job['run_seconds'] >= 0
+
+    assert client.get(job_url).status_code == 422
+
+    # the job of a killed worker is failed by the next claim
+    job = Job(name='auto_bp.delete_papers',
+              args={},
+              status='running',
+              progress={},
+              created=datetime.now() - timedelta(hours=2),
+              started=datetime.now() - timedelta(hours=2),
+              heartbeat=datetime.now() - timedelta(hours=1)
+              )
+    db.session.add(job)
+    db.session.commit()
+    job_url = url_for('auto_bp.job_status', job_id=job.id)
+    assert not run_next_job(app)
+    job = loads(client.get(job_url, headers={"token": "test_token"}).data)  # nosec
+    assert job['status'] == 'failed'
+    assert 'heartbeat' in job['error']
+    Job.query.delete()
+    db.session.commit()
+
+
+def test_job_queue_after_jobs(app, client):
+    """Test the hooks are queued again after the worker has run the jobs."""
+    url = url_for('auto_bp.delete_papers', until='2000-01-01', force=True)
+    app.config['JOB_QUEUE'] = True
+    try:
+        for _ in range(2):
+            response = client.post(url, headers={"token": "test_token"})  # nosec
+            assert response.status_code == 202
+        assert run_next_job(app)
+        assert run_next_job(app)
+        assert not run_next_job(app)
+
+        # the job state of the worker doesn't leak to the next request
+        response = client.post(url, headers={"token": "test_token"})  # nosec
+        assert response.status_code == 202
+    finally:
+        app.config['JOB_QUEUE'] = False
+    Job.query.delete()
+    db.session.commit()
+
+
+def test_job_queue_email_host(app, client, papers, user):
+    """Test the queued email links point to the host of the queuing request."""
+    user.tags[0].email = True
+    user.verified_email = True
+    UpdateDate.query.filter_by().delete()
+    db.session.commit()
+
+    url = url_for('auto_bp.email_papers', do_send=True)
+    server_name = app.config['SERVER_NAME']
+    # the requests are routed for any host
+    app.config['SERVER_NAME'] = None
+    app.config['JOB_QUEUE'] = True
+    try:
+        response = client.post(url,
+                               base_url='http://arxivtag.test',
+                               headers={"token": "test_token"}  # nosec
+                               )
+        assert response.status_code == 202
+        app.config['JOB_QUEUE'] = False
+
+        with mail.record_messages() as outbox:
+            while run_next_job(app):
+                pass
+            assert outbox
+            assert all('http://arxivtag.test/settings' in message.html for message in outbox)
+            assert all('localhost' not in message.html for message in outbox)
+    finally:
+        app.config['JOB_QUEUE'] = False
+        app.config['SERVER_NAME'] = server_name
+
+    ShardRun.query.delete()
+    Job.query.delete()
+    db.session.commit()
+
+
+def test_refresh_paper_cache(app):
+    """Test the incremental cache refresh touches only the changed rows."""
+    with app.app_context():
+        now = datetime.now()
+        start = now - timedelta(days=1)
+        for num, date in enumerate([now, now - timedelta(days=2)]):
+            db.session.add(Paper(paper_id=f'cache_test_{num}',
+                                 title='Cache test',
+                                 author=['Author'],
+                                 date_up=date,
+                                 date_sub=date,
+                                 version='v1',
+                                 source=1
+                                 ))
+        db.session.commit()
+
+        refresh_paper_cache(PaperCacheDay, start)
+        assert PaperCacheDay.query.filter_by(paper_id='cache_test_0').count() == 1
+        assert PaperCacheDay.query.filter_by(paper_id='cache_test_1').count() == 0
+        # nothing changed
+        assert refresh_paper_cache(PaperCacheDay, start) == {'inserted': 0,
+                                                              'updated': 0,
+                                                              'evicted': 0
+                                                              }
+
+        Paper.query.filter_by(paper_id='cache_test_0').first().title = 'Cache test updated'
+        Paper.query.filter_by(paper_id='cache_test_1').first().date_up = now
+        assert refresh_paper_cache(PaperCacheDay, start) == {'inserted': 1,
+                                                              'updated': 1,
+                                                              'evicted': 0
+                                                              }
+        cached = PaperCacheDay.query.filter_by(paper_id='cache_test_0').first()
+        assert cached.title == 'Cache test updated'
+
+        for paper in Paper.query.filter(Paper.paper_id.like('cache_test_%')):
+            db.session.delete(paper)
+        assert refresh_paper_cache(PaperCacheDay, start) == {'inserted': 0,
+                                                              'updated': 0,
+                                                              'evicted': 2
+                                                              }
+        db.session.commit()
+
+
+def test_rss_etag(client, user):
+    """Test RSS feed answers 304 until the harvest."""
+    url = url_for('auto_bp.rss_feed', token=encode_token({"user": EMAIL}))
+    response = client.get(url)
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # the rendered feed is reused without the conditional request
+    hits = feed_cache.info()['hits']
+    response = client.get(url)
+    assert response.status_code == 200
+    assert feed_cache.info()['hits'] == hits + 1
+
+    get_old_update_date().last_harvest = datetime.now()
+    db.session.commit()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
@@ -1,14 +1,16 @@
 """Test papers functionality."""
 # pylint: disable=redefined-outer-name, unused-argument, no-self-use
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from json import loads
 
 import pytest
 from flask import url_for
+from sqlalchemy import event
 
 from app import db
 from app.interfaces.model import Paper, User, PaperList
+from app.papers import listing_cache
 from test.conftest import EMAIL, PASS
 
 ROOT_LOAD = 'auto_bp.load_papers'
@@ -91,6 +93,66 @@ class TestMainPages:
         assert 'page=10000' not in response.history[-1].location
         assert 'page=1' in response.history[-1].location
 
+    def test_bookshelf_sorted_pages(self, client, login):
+        """Test the bookshelf pages are sorted and cut in the DB."""
+        paper_list = User.query.filter_by(email=EMAIL).first().lists[0]
+        now = datetime.now()
+        for num in range(30):
+            paper_list.papers.append(Paper(paper_id=f'bookshelf_test_{num:02}',
+                                           title='Bookshelf test',
+                                           author=['Author'],
+                                           date_up=now - timedelta(hours=num),
+                                           date_sub=now - timedelta(hours=30 - num),
+                                           version='v1',
+                                           abstract='Bookshelf abstract',
+                                           source=1
+                                           ))
+        db.session.commit()
+
+        response = client.get(url_for(ROOT_BOOKSHELF,
+                                      list_id=paper_list.id,
+                                      page=2,
+                                      sort='date-up_as'
+                                      ))
+        text = response.get_data(as_text=True)
+        assert response.status_code == 200
+        assert 'bookshelf_test_25' in text
+        assert 'bookshelf_test_24' not in text
+        assert '__NPAPERS__ = 30' in text
+
+        response = client.get(url_for(ROOT_BOOKSHELF,
+                                      list_id=paper_list.id,
+                                      page=1,
+                                      sort='date-sub_as'
+                                      ))
+        text = response.get_data(as_text=True)
+        assert 'bookshelf_test_29' in text
+        assert 'bookshelf_test_00' not in text
+        assert 'Bookshelf abstract' in text
+
+        # the list is loaded without the papers, only the page is read
+        loaded = []
+
+        def on_load(paper, context):
+            loaded.append(paper)
+
+        list_id = paper_list.id
+        db.session.expunge_all()
+        event.listen(Paper, 'load', on_load)
+        try:
+            response = client.get(url_for(ROOT_BOOKSHELF,
+                                          list_id=list_id,
+                                          page=1
+                                          ))
+        finally:
+            event.remove(Paper, 'load', on_load)
+        assert response.status_code == 200
+        assert not loaded
+
+        Paper.query.filter(Paper.paper_id.like('bookshelf_test_%')
+                           ).delete(synchronize_session=False)
+        db.session.commit()
+
     def test_pass_restore_page(self, client):
         """Test password restore page."""
         response = client.get(url_for('auth_bp.restore'))
@@ -194,6 +256,76 @@ class TestPaperPage:
 
         assert abs((date_list[0] - date_list[-1]).days) < 8
 
+    def test_paper_api_pages(self, client, login):
+        """Test the paginated API returns the same papers as the full response."""
+        # a fixed range, the month or the week depend on the test date
+        last = datetime(2021, 3, 10, 12)
+        dates = {'date': 'range', 'from': '01-03-2021', 'until': '15-03-2021'}
+        for num in range(20):
+            db.session.add(Paper(paper_id=f'data_page_test_{num:02}',
+                                 title='Data page test',
+                                 author=['Author'],
+                                 date_up=last - timedelta(hours=num * 12),
+                                 date_sub=last - timedelta(days=1, hours=num * 12),
+                                 version='v1',
+                                 abstract='Data page abstract',
+                                 cats=['hep-ex'],
+                                 source=1
+                                 ))
+        db.session.commit()
+        listing_cache.clear()
+
+        full = client.get(url_for(ROOT_DATA, **dates)).json
+        assert len(full['papers']) == 20
+        pages = [client.get(url_for(ROOT_DATA, page_size=6, **dates)).json]
+        while pages[-1]['cursor']:
+            pages.append(client.get(url_for(ROOT_DATA,
+                                            page_size=6,
+                                            cursor=pages[-1]['cursor'],
+                                            **dates
+                                            )).json)
+
+        assert len(pages) > 1
+        paged_ids = [paper['id'] for page in pages for paper in page['papers']]
+        assert len(paged_ids) == len(set(paged_ids))
+        assert set(paged_ids) == {paper['id'] for paper in full['papers']}
+        assert all(len(page['papers']) <= 6 for page in pages)
+        assert pages[0]['ncat'] == full['ncat']
+        assert pages[0]['ntag'] == full['ntag']
+        assert all(page['ncat'] is None for page in pages[1:])
+        assert all(paper['abstract'] for page in pages for paper in page['papers'])
+
+        wrong = client.get(url_for(ROOT_DATA, page_size=6, cursor='abracadabra', **dates))
+        assert wrong.status_code == 422
+        for page_size in [0, -6, 100000, 'abracadabra']:
+            wrong = client.get(url_for(ROOT_DATA, page_size=page_size, **dates))
+            assert wrong.status_code == 422
+
+        Paper.query.filter(Paper.paper_id.like('data_page_test_%')
+                           ).delete(synchronize_session=False)
+        db.session.commit()
+        listing_cache.clear()
+
+    def test_paper_api_etag(self, client, login, user):
+        """Test the API answers 304 until the listing is changed."""
+        response = client.get(url_for(ROOT_DATA, date='week'))
+        etag = response.headers['ETag']
+        assert response.status_code == 200
+
+        response = client.get(url_for(ROOT_DATA, date='week'), headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # other request
+        response = client.get(url_for(ROOT_DATA, date='month'), headers={'If-None-Match': etag})
+        assert response.status_code == 200
+
+        # tag update
+        user.tags[0].rule = 'ti{etag}'
+        db.session.commit()
+        response = client.get(url_for(ROOT_DATA, date='week'), headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
     def test_paper_page_args(self, client, login):
         """Test paper page load with different date types."""
         response1 = client.get(url_for(ROOT_PAPERS,
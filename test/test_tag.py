@@ -2,13 +2,19 @@
 # pylint: disable=redefined-outer-name, unused-argument
 
 from copy import copy
+from datetime import date, datetime, timedelta
 from typing import Generator
 
 import pytest
 from flask import url_for
 
+from app import db
 from app.interfaces.data_structures import PaperInterface
-from app.papers import tag_suitable
+from app.interfaces.model import Paper
+from app.paper_api import get_arxiv_sub_start, get_arxiv_sub_end
+from app.papers import tag_suitable, compile_rule, RuleCache, evaluate_rule_batch, \
+    rules_need_abstract, ListingCache, FeedCache, CategoryIndex, rows_size, announce_days, \
+    rules_to_sql, get_papers, listing_cache
 
 
 @pytest.fixture(scope='function')
@@ -66,6 +72,242 @@ def test_negation(simple_paper):
     assert not tag_suitable(paper_bad, rule)
 
 
+def test_compiled_rule(simple_paper):
+    """Test the rule compiled once is reusable for several papers."""
+    paper_other = copy(simple_paper)
+    paper_other.title = 'Boring title'
+
+    rule = compile_rule('(ti{awesome}|abs{heavy&neutrino})&au{!Au3}')
+    assert rule.evaluate(simple_paper)
+    assert not rule.evaluate(paper_other)
+    assert rule.evaluate(simple_paper) == tag_suitable(simple_paper, rule.rule)
+
+
+def test_compiled_wrong_regex(simple_paper):
+    """Test the broken regex in the rule is never suitable."""
+    assert not compile_rule('ti{awesome(}').evaluate(simple_paper)
+    assert compile_rule('abs{breakthrough}|ti{awesome(}').evaluate(simple_paper)
+
+
+def test_batch(simple_paper):
+    """Test the rule evaluation for the paper list at once."""
+    paper_heavy = copy(simple_paper)
+    paper_heavy.abstract = 'Look for neutrino with heavy detector'
+    paper_other = copy(simple_paper)
+    paper_other.title = 'Boring title'
+    papers = [simple_paper, paper_heavy, paper_other]
+
+    for rule in ['ti{awesome}',
+                 'ti{awesome}&abs{breakthrough}',
+                 'ti{boring}|abs{heavy&neutrino}',
+                 '(ti{awesome}|abs{HNL})&au{!Au2}'
+                 ]:
+        expected = [tag_suitable(paper, rule) for paper in papers]
+        assert evaluate_rule_batch(rule, papers) == expected
+
+
+def test_rule_to_sql():
+    """Test the tag rule filter in the DB selects all the suitable papers."""
+    for num, title in enumerate(['Heavy neutrino search',
+                                 'Dark matter',
+                                 'Neutrino oscillations',
+                                 'Antineutrino flux'
+                                 ]):
+        db.session.add(Paper(paper_id=f'sql_test_{num}',
+                             title=title,
+                             author=['Au1', 'Au2'],
+                             date_up=datetime.now(),
+                             date_sub=datetime.now(),
+                             version='v1',
+                             abstract='Breakthrough is coming',
+                             cats=['hep-ex'],
+                             source=1
+                             ))
+    db.session.commit()
+
+    query = Paper.query.filter(Paper.paper_id.like('sql_test_%'))
+    # author search text is filled with the author list
+    assert query.first().author_text == 'au1, au2'
+    for rule in ['ti{heavy&neutrino|dark}',
+                 'ti{neutrino}&au{!Au3}',
+                 'ti{neutrino}&abs{break(through)?}',
+                 'ti{dark}|cat{hep-ex}',
+                 'au{AU2}&ti{!dark}',
+                 'ti{neutrino}'
+                 ]:
+        compiled = compile_rule(rule)
+        expected = {paper.paper_id for paper in query.all()
+                    if compiled.evaluate(PaperInterface.from_paper(paper))}
+        found = {paper.paper_id for paper in query.filter(compiled.to_sql(Paper)).all()}
+        assert expected <= found
+
+    # regex that can't be translated
+    assert compile_rule('ti{neutrino$}').to_sql(Paper) is None
+
+    # the condition inside a word is found as well, so the filter is a prefilter
+    rule_filter = rules_to_sql(['ti{neutrino}', 'ti{dark}&abs{break}'], Paper)
+    assert {paper.paper_id for paper in query.filter(rule_filter).all()} == {'sql_test_0',
+                                                                             'sql_test_1',
+                                                                             'sql_test_2',
+                                                                             'sql_test_3'
+                                                                             }
+    assert rules_to_sql(['ti{neutrino}', 'ti{neutrino$}'], Paper) is None
+
+    # the papers stored before the author text was introduced
+    query.update({Paper.author_text: None}, synchronize_session=False)
+    db.session.commit()
+    for rule, expected in [('au{au2}', 4), ('au{!au3}', 4), ('au{au3}', 0), ('au{!au2}', 0)]:
+        assert query.filter(compile_rule(rule).to_sql(Paper)).count() == expected
+
+    query.delete(synchronize_session=False)
+    db.session.commit()
+
+
+def test_rule_cache():
+    """Test LRU cache of the compiled rules."""
+    cache = RuleCache(maxsize=2)
+    rule = cache.get('ti{awesome}')
+    assert cache.get('ti{awesome}') is rule
+    assert cache.info()['hits'] == 1
+    assert cache.info()['misses'] == 1
+
+    # the least recently used rule is dropped
+    cache.get('abs{neutrino}')
+    cache.get('au{Au1}')
+    assert cache.info()['size'] == 2
+    assert cache.get('ti{awesome}') is not rule
+
+    cache.invalidate('au{Au1}')
+    assert cache.info()['size'] == 1
+
+
+def test_listing_cache():
+    """Test LRU cache of the paper listings."""
+    cache = ListingCache(maxsize=2)
+    loads = []
+
+    def loader(rows):
+        loads.append(rows)
+        return rows
+
+    assert cache.get(('hep-ex', 1), lambda: loader(['paper'])) == ['paper']
+    assert cache.get(('hep-ex', 1), lambda: loader(['other'])) == ['paper']
+    assert cache.info()['hits'] == 1
+    assert len(loads) == 1
+
+    # the least recently used listing is dropped
+    cache.get(('hep-ph', 1), lambda: loader([]))
+    cache.get(('hep-th', 1), lambda: loader([]))
+    assert cache.info()['size'] == 2
+    assert cache.get(('hep-ex', 1), lambda: loader(['new'])) == ['new']
+
+    # the byte limit drops the slices as well
+    cache.resize(2, rows_size([('paper',)]))
+    cache.get(('hep-ex', 2), lambda: [('paper',)])
+    cache.get(('hep-ph', 2), lambda: [('paper',)])
+    assert cache.info()['size'] == 1
+    assert cache.info()['bytes'] <= cache.maxbytes
+
+    cache.clear()
+    assert cache.info()['size'] == 0
+
+
+def test_announce_days(app):
+    """Test the submission ranges are split into the announcement days."""
+    with app.app_context():
+        thursday = date(2026, 10, 15)
+        week = announce_days(get_arxiv_sub_start(thursday - timedelta(days=3)),
+                             get_arxiv_sub_end(thursday)
+                             )
+        assert week == [thursday - timedelta(days=day) for day in range(3, -1, -1)]
+        # the weekend is skipped
+        monday = date(2026, 10, 19)
+        assert announce_days(get_arxiv_sub_start(thursday), get_arxiv_sub_end(monday)) == \
+            [thursday, thursday + timedelta(days=1), monday]
+        # a range inside the day is not cached
+        assert announce_days(datetime(2026, 10, 14, 12), get_arxiv_sub_end(thursday)) is None
+
+
+def test_cached_rows_bounds(app):
+    """Test the cached day slices select the same papers as the single range query."""
+    thursday = date(2021, 1, 14)
+    friday = thursday + timedelta(days=1)
+    old_date = get_arxiv_sub_start(thursday)
+    new_date = get_arxiv_sub_end(friday)
+    # the range bounds and the bound between the days
+    for num, date_up in enumerate([old_date, get_arxiv_sub_end(thursday), new_date]):
+        db.session.add(Paper(paper_id=f'bound_test_{num}',
+                             title='Bound test',
+                             author=['Au1'],
+                             date_up=date_up,
+                             date_sub=date_up,
+                             version='v1',
+                             cats=['bound-test'],
+                             source=1
+                             ))
+    db.session.commit()
+    listing_cache.clear()
+
+    cached = get_papers(['bound-test'], old_date, new_date)
+    assert listing_cache.info()['size'] == 2
+    assert [paper.id for paper in cached] == \
+        [paper.id for paper in get_papers(['bound-test'], old_date, new_date, cached=False)]
+    assert [paper.paper_id for paper in cached] == ['bound_test_1']
+
+    Paper.query.filter(Paper.paper_id.like('bound_test_%')).delete(synchronize_session=False)
+    db.session.commit()
+    listing_cache.clear()
+
+
+def test_feed_cache():
+    """Test cache of the rendered RSS feeds."""
+    cache = FeedCache(maxsize=2, maxbytes=10)
+    cache.put(1, 'v1', b'feed')
+    assert cache.get(1, 'v1') == b'feed'
+    # the other version is a miss
+    assert cache.get(1, 'v2') is None
+    assert cache.info()['hits'] == 1
+    assert cache.info()['misses'] == 1
+
+    # the byte limit drops the least recently used feed
+    cache.put(2, 'v1', b'feed2')
+    cache.put(3, 'v1', b'feed3')
+    assert cache.get(1, 'v1') is None
+    assert cache.info()['bytes'] == 10
+    # too large feed is not stored
+    cache.put(4, 'v1', b'a very long feed')
+    assert cache.get(4, 'v1') is None
+
+    cache.invalidate(2)
+    assert cache.get(2, 'v1') is None
+    assert cache.info()['size'] == 1
+
+
+def test_category_index():
+    """Test the users with the same categories share the paper list."""
+    papers = [Paper(id=num, paper_id=str(num), title=f'Paper {num}', author=['Au1'], cats=cats)
+              for num, cats in enumerate([['hep-ex'], ['hep-ph', 'hep-ex'], ['astro-ph']])]
+    index = CategoryIndex(papers)
+
+    selected, corpus = index.get(['hep-ph', 'hep-ex'])
+    assert [paper.id for paper in selected] == [0, 1]
+    assert corpus.field('ti') == ['Paper 0', 'Paper 1']
+    assert index.get(['hep-ex', 'hep-ph'])[1] is corpus
+    assert index.get(['gr-qc'])[0] == []
+
+    info = index.info()
+    assert info['requests'] == 3
+    assert info['groups'] == 2
+    assert info['queries_saved'] == 2
+
+
+def test_rules_need_abstract():
+    """Test the abstract is requested only by the abs{} rules."""
+    assert not rules_need_abstract(['ti{awesome}|au{Au1}', 'cat{hep-ex}'])
+    assert rules_need_abstract(['ti{awesome}', 'cat{hep-ex}&abs{!neutrino}'])
+    assert not rules_need_abstract([])
+
+
 def test_tag_endpoint(client, login):
     """Test the tag test endpoint."""
     response = client.get(url_for('main_bp.test_tag',